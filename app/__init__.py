@@ -10,11 +10,30 @@ from dmutils.external import external as external_blueprint
 from govuk_frontend_jinja.flask_ext import init_govuk_frontend
 
 from config import configs
+from .assets import AssetPreloader, InlineAssets, init_asset_fingerprinter, init_static_view
+from .error_pages import ErrorPageCache
+from .notify import NotifyClient
+from .outbox import EmailOutbox
+from .page_cache import RenderedPageCache
+from .templating import init_templating
+from .throttling import ResetPasswordRequestSuppressor
+from .timing import ResponseTimeEqualiser
+from .tokens import InvitationTokenCache, TokenService
 
 
 login_manager = LoginManager()
 data_api_client = dmapiclient.DataAPIClient()
 csrf = CSRFProtect()
+token_service = TokenService()
+invitation_token_cache = InvitationTokenCache(token_service)
+notify_client = NotifyClient()
+email_outbox = EmailOutbox(notify_client)
+reset_password_suppressor = ResetPasswordRequestSuppressor()
+reset_password_timing = ResponseTimeEqualiser('reset_password', 'DM_RESET_PASSWORD')
+rendered_page_cache = RenderedPageCache()
+error_page_cache = ErrorPageCache()
+asset_preloader = AssetPreloader()
+inline_assets = InlineAssets()
 
 
 def create_app(config_name):
@@ -31,6 +50,9 @@ def create_app(config_name):
         data_api_client=data_api_client,
         login_manager=login_manager,
     )
+    init_templating(application)
+    init_asset_fingerprinter(application)
+    init_static_view(application)
 
     from .metrics import metrics as metrics_blueprint, gds_metrics
     from .main import main as main_blueprint
@@ -50,6 +72,16 @@ def create_app(config_name):
     login_manager.login_message = None  # don't flash message to user
     gds_metrics.init_app(application)
     csrf.init_app(application)
+    token_service.init_app(application)
+    invitation_token_cache.init_app(application)
+    notify_client.init_app(application)
+    email_outbox.init_app(application)
+    reset_password_suppressor.init_app(application)
+    reset_password_timing.init_app(application)
+    rendered_page_cache.init_app(application)
+    error_page_cache.init_app(application)
+    asset_preloader.init_app(application)
+    inline_assets.init_app(application)
 
     @application.before_request
     def remove_trailing_slash():
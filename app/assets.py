@@ -0,0 +1,323 @@
+import json
+import mimetypes
+import os
+
+import jinja2
+from jinja2 import Markup, meta, nodes
+from dmutils.asset_fingerprint import AssetFingerprinter
+from flask import before_render_template, current_app, request, safe_join, send_file
+from werkzeug.exceptions import NotFound
+from werkzeug.urls import url_quote
+
+
+# encodings of the compressed copies of assets made by the front-end build, most preferred first
+PRECOMPRESSED_ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# fingerprinted asset URLs change whenever the asset does, so their responses can be cached as long as browsers allow
+FINGERPRINTED_ASSET_MAX_AGE = 365 * 24 * 60 * 60
+
+# the ways `DM_STATIC_OFFLOAD` can have the web server in front of the app send static files
+STATIC_OFFLOAD_MODES = (None, 'x-sendfile', 'x-accel-redirect')
+
+# the request destination (the `as` of a preload link) for each kind of asset worth preloading
+PRELOAD_DESTINATIONS = {'.css': 'style', '.js': 'script'}
+
+
+class ManifestAssetFingerprinter(AssetFingerprinter):
+    """
+    An `AssetFingerprinter` that takes fingerprints from a manifest written at build time by
+    `scripts/fingerprint_assets.py`, rather than reading and hashing each asset the first time its URL is needed.
+    Assets missing from the manifest are fingerprinted as usual.
+    """
+
+    def __init__(self, manifest, asset_root='/static/', filesystem_path='app/static/'):
+        super().__init__(asset_root=asset_root, filesystem_path=filesystem_path)
+        self._manifest = manifest
+
+    @classmethod
+    def from_file(cls, manifest_path, **kwargs):
+        with open(manifest_path) as f:
+            return cls(json.load(f), **kwargs)
+
+    def get_fingerprint(self, asset_path):
+        return self._manifest.get(asset_path)
+
+    def get_url(self, asset_path):
+        fingerprint = self.get_fingerprint(asset_path)
+        if fingerprint is None:
+            return super().get_url(asset_path)
+        return '{}{}?{}'.format(self._asset_root, asset_path, fingerprint)
+
+
+def init_asset_fingerprinter(app):
+    """Fingerprint assets using the manifest at `DM_ASSET_MANIFEST_PATH`, if set"""
+    manifest_path = app.config['DM_ASSET_MANIFEST_PATH']
+    if not manifest_path:
+        return
+
+    try:
+        fingerprinter = ManifestAssetFingerprinter.from_file(manifest_path, asset_root=app.config['ASSET_PATH'])
+    except (OSError, ValueError) as e:
+        app.logger.warning(
+            "Asset manifest {path} is unavailable - assets will be fingerprinted at runtime: {error}",
+            extra={'path': manifest_path, 'error': str(e)},
+        )
+        return
+
+    # a copy, as the default is shared by every app made from the same config class
+    app.config['BASE_TEMPLATE_DATA'] = dict(app.config['BASE_TEMPLATE_DATA'], asset_fingerprinter=fingerprinter)
+
+
+def _is_fingerprinted(manifest_fingerprinter, filename):
+    """
+    Whether the request is for the current fingerprinted URL of `filename`, rather than any other version of it.
+
+    Only the build-time manifest is consulted - files named by requests are never read and hashed to find out.
+    """
+    fingerprint = manifest_fingerprinter.get_fingerprint(filename)
+    return fingerprint is not None and request.query_string.decode('utf-8', 'replace') == fingerprint
+
+
+def _negotiate_encoding(static_folder, filename):
+    """
+    The encoding and name of the file to send for `filename` - the most preferred compressed copy made by the
+    front-end build that the client accepts, or the file itself - and whether there were any compressed copies.
+    """
+    variants = [
+        (encoding, filename + suffix) for encoding, suffix in PRECOMPRESSED_ENCODINGS
+        if os.path.isfile(safe_join(static_folder, filename + suffix))
+    ]
+    for encoding, name in variants:
+        if request.accept_encodings[encoding]:
+            return encoding, name, True
+    return None, filename, bool(variants)
+
+
+def send_static_file(filename):
+    """
+    Flask's static file view, but sending a compressed copy of the file made by the front-end build if there's one
+    in an encoding the client accepts. Responses for files with compressed copies vary on `Accept-Encoding`.
+
+    Requests for an asset's current fingerprinted URL (according to the asset manifest) are cached for a year and
+    marked immutable, as the URL will change with the asset. Everything else gets the usual max-age, with an ETag for
+    revalidation taken from the asset manifest (so that it's the same on every instance) if the file's in it.
+
+    With `DM_STATIC_OFFLOAD` set, responses carry the location of the file for the web server to send instead of its
+    contents.
+    """
+    app = current_app
+    # raises NotFound for anything outside the static folder, before the filename is used for anything else
+    safe_join(app.static_folder, filename)
+
+    fingerprinter = app.config['BASE_TEMPLATE_DATA']['asset_fingerprinter']
+    manifest = fingerprinter if isinstance(fingerprinter, ManifestAssetFingerprinter) else None
+    fingerprinted = manifest is not None and _is_fingerprinted(manifest, filename)
+
+    encoding, name, has_variants = _negotiate_encoding(app.static_folder, filename)
+    path = safe_join(app.static_folder, name)
+    if not os.path.isfile(path):
+        raise NotFound()
+
+    etag = manifest.get_fingerprint(name) if manifest is not None else None
+    offload = app.config['DM_STATIC_OFFLOAD']
+    response = send_file(
+        path,
+        mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+        add_etags=etag is None,
+        conditional=False,
+        cache_timeout=FINGERPRINTED_ASSET_MAX_AGE if fingerprinted else app.get_send_file_max_age(filename),
+    )
+    if etag is not None:
+        response.set_etag(etag)
+    if offload:
+        # the web server answers range requests itself
+        response.make_conditional(request)
+        _offload(response, offload, name)
+    else:
+        response.make_conditional(request, accept_ranges=True, complete_length=response.content_length)
+
+    if encoding:
+        response.content_encoding = encoding
+    if has_variants:
+        response.vary.add('Accept-Encoding')
+    if fingerprinted:
+        response.headers['Cache-Control'] = 'public, max-age={}, immutable'.format(FINGERPRINTED_ASSET_MAX_AGE)
+    return response
+
+
+def _offload(response, offload, name):
+    """Swap the X-Sendfile header `send_file` adds in `USE_X_SENDFILE` mode for what the configured server expects"""
+    sendfile = response.headers.pop('X-Sendfile', None)
+    if sendfile is None or response.status_code != 200:
+        return
+    if offload == 'x-accel-redirect':
+        # the response itself is empty - nginx gives the length of the file it sends
+        del response.headers['Content-Length']
+        response.headers['X-Accel-Redirect'] = current_app.config['DM_STATIC_OFFLOAD_PREFIX'] + url_quote(name)
+    else:
+        response.headers['X-Sendfile'] = sendfile
+
+
+def init_static_view(app):
+    """
+    Serve static files with `send_static_file`, having the web server in front of the app send the files themselves
+    if `DM_STATIC_OFFLOAD` is set.
+    """
+    offload = app.config['DM_STATIC_OFFLOAD'] or None
+    if offload not in STATIC_OFFLOAD_MODES:
+        app.logger.warning(
+            "Unknown DM_STATIC_OFFLOAD {offload} - static files will be sent by the app",
+            extra={'offload': offload},
+        )
+        offload = app.config['DM_STATIC_OFFLOAD'] = None
+    if offload:
+        app.config['USE_X_SENDFILE'] = True
+
+    app.view_functions['static'] = send_static_file
+
+
+def find_template_assets(environment, template_name, loader=None, parsed=None):
+    """
+    The paths of the assets that a template (or any template it extends, includes or imports) gets URLs for with
+    `asset_fingerprinter.get_url('...')`, in the order they're first found. Templates that can't be loaded, and
+    references to templates or assets that aren't literal strings, are skipped.
+
+    This parses every template involved, so is only meant for build time - see `scripts/compile_templates.py`.
+
+    :param loader: where to read template source from, if not the environment's own loader (which may only have
+                   compiled templates)
+    :param parsed: a dict to keep what's been found in each template in, so that finding the assets of many templates
+                   sharing a layout and macros needn't parse them again
+    """
+    loader = loader or environment.loader
+    parsed = {} if parsed is None else parsed
+    assets, seen, pending = [], set(), [template_name]
+    while pending:
+        name = pending.pop(0)
+        if name in seen:
+            continue
+        seen.add(name)
+        if name not in parsed:
+            parsed[name] = _parse_template_assets(environment, loader, name)
+        template_assets, references = parsed[name]
+
+        assets.extend(asset for asset in template_assets if asset not in assets)
+        pending.extend(references)
+    return assets
+
+
+def _parse_template_assets(environment, loader, name):
+    try:
+        source, filename, _ = loader.get_source(environment, name)
+    except jinja2.TemplateNotFound:
+        return [], []
+    ast = environment.parse(source, name, filename)
+
+    assets = [
+        call.args[0].value for call in ast.find_all(nodes.Call)
+        if isinstance(call.node, nodes.Getattr) and call.node.attr == 'get_url'
+        and isinstance(call.node.node, nodes.Name) and call.node.node.name == 'asset_fingerprinter'
+        and len(call.args) == 1 and isinstance(call.args[0], nodes.Const)
+    ]
+    return assets, [reference for reference in meta.find_referenced_templates(ast) if reference]
+
+
+class AssetPreloader(object):
+    """
+    Adds `Link: <...>; rel=preload` headers for the fingerprinted stylesheets and scripts a page uses, so that the
+    browser (or a CDN able to turn them into 103 Early Hints) can start fetching them before it has parsed the page.
+
+    The assets each template uses are found when the templates are compiled, by `scripts/compile_templates.py`, and
+    loaded from `DM_TEMPLATE_ASSETS_PATH` at startup - templates are never parsed for them while serving requests.
+    Links are remembered per route as templates are rendered, so that pages served from a cache without being rendered
+    get the same headers. Only successful HTML responses get them. uWSGI can't send informational responses, so Early
+    Hints are left to whatever is in front of the app.
+    """
+
+    def __init__(self):
+        self._template_links = {}
+        self._endpoint_links = {}
+
+    def init_app(self, app):
+        self._template_links, self._endpoint_links = {}, {}
+        path = app.config['DM_TEMPLATE_ASSETS_PATH']
+        if not path:
+            return
+
+        try:
+            with open(path) as f:
+                template_assets = json.load(f)
+        except (OSError, ValueError) as e:
+            app.logger.warning(
+                "Template assets {path} are unavailable - pages won't have preload links: {error}",
+                extra={'path': path, 'error': str(e)},
+            )
+            return
+
+        fingerprinter = app.config['BASE_TEMPLATE_DATA']['asset_fingerprinter']
+        self._template_links = {
+            template_name: self._links(fingerprinter, asset_paths)
+            for template_name, asset_paths in template_assets.items()
+        }
+        before_render_template.connect(self._template_rendering, app)
+        app.after_request(self._add_link_headers)
+
+    def _links(self, fingerprinter, asset_paths):
+        links = []
+        for asset_path in asset_paths:
+            destination = PRELOAD_DESTINATIONS.get(os.path.splitext(asset_path)[1])
+            if destination is None:
+                continue
+            try:
+                links.append('<{}>; rel=preload; as={}'.format(fingerprinter.get_url(asset_path), destination))
+            except (OSError, ValueError):
+                continue
+        return tuple(links)
+
+    def _template_rendering(self, app, template, context):
+        template_links = self._template_links.get(template.name)
+        if not template_links or not request:
+            return
+        links = self._endpoint_links.get(request.endpoint, ())
+        self._endpoint_links[request.endpoint] = links + tuple(link for link in template_links if link not in links)
+
+    def _add_link_headers(self, response):
+        links = self._endpoint_links.get(request.endpoint)
+        # not for redirects and the like, which Flask also sends as HTML
+        if links and response.status_code == 200 and response.mimetype == 'text/html':
+            response.headers.add('Link', ', '.join(links))
+        return response
+
+
+class InlineAssets(object):
+    """
+    Reads built assets (such as the critical stylesheet) for templates to inline with `inline_asset('...')`, keeping
+    their contents in memory unless the app is in debug mode. Assets that haven't been built are inlined as nothing, so
+    templates can fall back to linking to them.
+    """
+
+    def __init__(self):
+        self._contents = {}
+
+    def init_app(self, app):
+        self._contents = {}
+        app.add_template_global(self.inline_asset)
+
+    def inline_asset(self, asset_path):
+        contents = self._contents.get(asset_path)
+        if contents is None:
+            contents = self._read(asset_path)
+            if not current_app.debug:
+                self._contents[asset_path] = contents
+        return contents
+
+    def _read(self, asset_path):
+        try:
+            path = safe_join(current_app.static_folder, asset_path)
+        except NotFound:
+            return Markup('')
+        if not os.path.isfile(path):
+            return Markup('')
+        with open(path, encoding='utf-8') as f:
+            # so that the asset can't close the element it's inlined into
+            return Markup(f.read().replace('</', '<\\/'))
@@ -0,0 +1,92 @@
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+from gds_metrics.metrics import Counter
+
+
+CACHE_LOOKUPS_TOTAL = Counter(
+    'cache_lookups_total',
+    'Lookups in named in-process caches',
+    ['cache', 'result']
+)
+
+
+class ExpiringLRUCache(object):
+    """
+    A small, thread-safe, size-bounded cache whose entries expire after `ttl` seconds.
+
+    Caches built from this class live in a single worker process - nothing is shared between workers, so anything
+    stored here must be safe to serve slightly stale for up to `ttl` seconds.
+
+    If a `name` is given, hits and misses are counted in the `cache_lookups_total` metric.
+    """
+
+    def __init__(self, maxsize, ttl, name=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.name = name
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires_at = self._entries[key]
+            except KeyError:
+                return self._miss(default)
+
+            if expires_at <= monotonic():
+                del self._entries[key]
+                return self._miss(default)
+
+            self._entries.move_to_end(key)
+
+        if self.name:
+            CACHE_LOOKUPS_TOTAL.labels(self.name, 'hit').inc()
+        return value
+
+    def _miss(self, default):
+        if self.name:
+            CACHE_LOOKUPS_TOTAL.labels(self.name, 'miss').inc()
+        return default
+
+    def set(self, key, value, ttl=None):
+        if self.maxsize <= 0:
+            return
+
+        expires_at = monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._store(key, value, expires_at)
+
+    def add(self, key, value, ttl=None):
+        """Store `value` only if `key` has no unexpired entry, returning whether it was stored."""
+        if self.maxsize <= 0:
+            return True
+
+        now = monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                return False
+
+            self._store(key, value, now + (self.ttl if ttl is None else ttl))
+            return True
+
+    def _store(self, key, value, expires_at):
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            value, _ = self._entries.pop(key, (default, None))
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,64 @@
+from flask import current_app, request, session
+from flask_login import current_user
+
+from dmutils.errors import render_error_page
+
+from .caching import ExpiringLRUCache
+
+
+# the status codes `dmutils.errors.render_error_page` has templates for - it renders a 500 page for any other
+ERROR_PAGE_STATUS_CODES = (400, 404, 410, 500, 503)
+
+
+class ErrorPageCache(object):
+    """
+    Keeps rendered error pages, so that when the Data API is down (and every request ends in an error page) they
+    needn't be rendered again for each request.
+
+    Pages are cached per status code, user role and path, as the page header depends on those. Pages with a custom
+    error message, or shown when there are flashed messages waiting, aren't cached.
+
+    Like the other in-process caches this is per-worker. A `DM_ERROR_PAGE_CACHE_SIZE` of 0 turns it off.
+    """
+
+    def __init__(self):
+        self._cache = ExpiringLRUCache(maxsize=0, ttl=0)
+
+    def init_app(self, app):
+        self._cache = ExpiringLRUCache(
+            maxsize=app.config['DM_ERROR_PAGE_CACHE_SIZE'],
+            ttl=app.config['DM_ERROR_PAGE_CACHE_TTL'],
+            name='error_pages',
+        )
+        for status_code in ERROR_PAGE_STATUS_CODES:
+            app.register_error_handler(status_code, self.render_error_page)
+
+    def render_error_page(self, e=None, status_code=None, error_message=None):
+        """A drop-in replacement for `dmutils.errors.render_error_page` that serves pages from the cache"""
+        if error_message is not None or self._cache.maxsize <= 0 or session.get('_flashes'):
+            return render_error_page(e, status_code, error_message)
+
+        status_code = _error_page_status_code(e, status_code)
+        key = (status_code, current_user.role if current_user.is_authenticated else None, request.path)
+        page = self._cache.get(key)
+        if page is None:
+            page, status_code = render_error_page(e, status_code)
+            self._cache.set(key, page)
+        elif status_code > 499:
+            # as `render_error_page` would have
+            current_app.logger.warning("Rendering error page", exc_info=True, extra={
+                "e": e,
+                "status_code": status_code,
+                "error_message": None,
+            })
+
+        return page, status_code
+
+
+def _error_page_status_code(e, status_code):
+    """The status code `dmutils.errors.render_error_page` would use for an error page"""
+    if not (e or status_code):
+        return 500
+    if not status_code:
+        status_code = getattr(e, 'status_code', getattr(e, 'code', 500))
+    return status_code if status_code in ERROR_PAGE_STATUS_CODES else 500
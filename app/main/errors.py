@@ -2,9 +2,9 @@
 
 from . import main
 from dmapiclient import APIError
-from dmutils.errors import render_error_page
+from .. import error_page_cache
 
 
 @main.app_errorhandler(APIError)
 def api_error_handler(e):
-    return render_error_page(status_code=e.status_code)
+    return error_page_cache.render_error_page(status_code=e.status_code)
@@ -23,7 +23,7 @@ from dmutils.dmp_so_status import are_new_frameworks_live
 from .. import main
 from ..forms.auth_forms import LoginForm
 from ..helpers.login_helpers import redirect_logged_in_user, is_there_a_live_g_cloud_framework
-from ... import data_api_client
+from ... import data_api_client, rendered_page_cache
 
 
 NO_ACCOUNT_MESSAGE = Markup("""Check you’ve entered the correct email address and password. Accounts
@@ -39,14 +39,17 @@ def render_login():
 
     form = LoginForm()
     errors = get_errors_from_wtform(form)
+    new_frameworks_live = are_new_frameworks_live(request.args)
+    g_cloud_frameworks_live = is_there_a_live_g_cloud_framework(data_api_client)
 
-    return render_template(
+    return rendered_page_cache.render_template(
         "auth/login.html",
+        vary_on=(next_url, new_frameworks_live, g_cloud_frameworks_live),
         form=form,
         errors=errors,
         next=next_url,
-        are_new_frameworks_live=are_new_frameworks_live(request.args),
-        g_cloud_frameworks_live=is_there_a_live_g_cloud_framework(data_api_client)), 200
+        are_new_frameworks_live=new_frameworks_live,
+        g_cloud_frameworks_live=g_cloud_frameworks_live), 200
 
 
 @main.route('/login', methods=["POST"])
@@ -1,9 +1,9 @@
 # coding: utf-8
 from .. import main
-from dmutils.flask import timed_render_template as render_template
+from ... import rendered_page_cache
 
 
 @main.route('/cookie-settings', methods=["GET"])
 def cookie_settings():
     # Preferences saved client side as cookies, so no POST required
-    return render_template('cookies/cookie_settings.html')
+    return rendered_page_cache.render_template('cookies/cookie_settings.html')
@@ -1,9 +1,8 @@
-from flask import abort, current_app, Markup
+from flask import abort, current_app, Markup, Response
 from flask_login import login_user
 
 from dmapiclient import HTTPError
 from dmutils.errors import render_error_page
-from dmutils.email import decode_invitation_token
 from dmutils.flask import timed_render_template as render_template
 from dmutils.forms.helpers import get_errors_from_wtform
 from dmutils.user import User
@@ -11,7 +10,8 @@ from dmutils.user import User
 from .. import main
 from ..forms.auth_forms import CreateUserForm
 from ..helpers.login_helpers import redirect_logged_in_user
-from ... import data_api_client
+from ... import data_api_client, invitation_token_cache
+from ...templating import stream_template
 
 
 INVALID_TOKEN_MESSAGE = Markup(
@@ -24,7 +24,7 @@ INVALID_TOKEN_MESSAGE = Markup(
 
 @main.route('/create/<string:encoded_token>', methods=["GET"])
 def create_user(encoded_token):
-    token = decode_invitation_token(encoded_token)
+    token = invitation_token_cache.decode(encoded_token)
 
     if token.get('error') == 'token_invalid':
         current_app.logger.warning(
@@ -57,14 +57,14 @@ def create_user(encoded_token):
     user_json = data_api_client.get_user(email_address=token["email_address"])
 
     if not user_json:
-        return render_template(
+        return Response(stream_template(
             "auth/create-user.html",
             email_address=token['email_address'],
             form=form,
             errors=get_errors_from_wtform(form),
             role=role,
             supplier_name=token.get('supplier_name'),
-            token=encoded_token), 200
+            token=encoded_token)), 200
 
     user = User.from_json(user_json)
     return render_template(
@@ -78,7 +78,7 @@ def create_user(encoded_token):
 
 @main.route('/create/<string:encoded_token>', methods=["POST"])
 def submit_create_user(encoded_token):
-    token = decode_invitation_token(encoded_token)
+    token = invitation_token_cache.decode(encoded_token)
 
     if token.get('error') == 'token_invalid':
         current_app.logger.warning(
@@ -1,9 +1,9 @@
 # -*- coding: utf-8 -*-
 
-from flask import current_app, flash, redirect, url_for, Markup, abort
+from flask import current_app, flash, redirect, url_for, Markup
 from flask_login import current_user, login_required
 
-from dmutils.email import DMNotifyClient, generate_token, decode_password_reset_token, EmailError
+from dmutils.email import EmailError
 from dmutils.email.helpers import hash_string
 from dmutils.flask import timed_render_template as render_template
 from dmutils.forms.helpers import get_errors_from_wtform
@@ -13,7 +13,14 @@ from .. import main
 from ..forms.auth_forms import EmailAddressForm, PasswordResetForm, PasswordChangeForm
 from ..helpers.logging_helpers import log_email_error
 from ..helpers.login_helpers import get_user_dashboard_url
-from ... import data_api_client
+from ... import (
+    data_api_client,
+    email_outbox,
+    rendered_page_cache,
+    reset_password_suppressor,
+    reset_password_timing,
+    token_service,
+)
 
 
 EMAIL_SENT_MESSAGE = Markup(
@@ -30,16 +37,15 @@ EXPIRED_PASSWORD_RESET_TOKEN_MESSAGE = Markup(
 
 PASSWORD_UPDATED_MESSAGE = "Your password has been successfully changed."
 PASSWORD_NOT_UPDATED_MESSAGE = "Your password could not be updated, due to an error."
-NOTIFY_SANDBOX_ADDRESS = "simulate-delivered@notifications.service.gov.uk"
 
 
 @main.route('/reset-password', methods=["GET"])
 def request_password_reset():
     form = EmailAddressForm()
     errors = get_errors_from_wtform(form)
-    return render_template("auth/request-password-reset.html",
-                           errors=errors,
-                           form=form), 200
+    return rendered_page_cache.render_template("auth/request-password-reset.html",
+                                               errors=errors,
+                                               form=form), 200
 
 
 @main.route('/reset-password', methods=["POST"])
@@ -47,117 +53,126 @@ def send_reset_password_email():
     form = EmailAddressForm()
     if form.validate_on_submit():
         email_address = form.email_address.data
-        user_json = data_api_client.get_user(email_address=email_address)
-        notify_client = DMNotifyClient(current_app.config['DM_NOTIFY_API_KEY'])
-
-        if user_json is not None:
-            user = User.from_json(user_json)
-            if user.role in ("admin-manager",):
-                # if this user wants their password reset they'll have to come to us
-                current_app.logger.warning(
-                    "{code}: Password reset requested for {user_role} user '{email_hash}'",
+        # whichever branch is taken below, the response should take as long as sending a real email would
+        with reset_password_timing.equalise() as record_send_time:
+            if reset_password_suppressor.should_send(email_address):
+                try:
+                    if _send_reset_password_email(email_address):
+                        record_send_time()
+                except EmailError:
+                    # Already logged. Nothing was sent, so don't stop the user trying again straight away - but answer
+                    # as for any other address, so that the response doesn't give away whether the account exists
+                    reset_password_suppressor.forget(email_address)
+                except Exception:
+                    # nothing was sent, so don't stop the user trying again straight away
+                    reset_password_suppressor.forget(email_address)
+                    raise
+            else:
+                current_app.logger.info(
+                    "{code}: Ignored repeat password reset request for email_hash {email_hash}",
                     extra={
-                        "code": "login.reset-email.bad-role",
-                        "email_hash": hash_string(user.email_address),
-                        "user_role": user.role,
+                        'email_hash': hash_string(email_address),
+                        'code': 'login.reset-email.suppressed'
                     }
                 )
 
-            elif user.active:  # specifically checking just .active, ignoring whether account is "locked"
-                token = generate_token(
-                    {
-                        "user": user.id
-                    },
-                    current_app.config['SHARED_EMAIL_KEY'],
-                    current_app.config['RESET_PASSWORD_TOKEN_NS']
-                )
+        flash(EMAIL_SENT_MESSAGE.format(support_email=current_app.config['SUPPORT_EMAIL_ADDRESS']), "success")
+        return redirect(url_for('.request_password_reset'))
+    else:
+        return render_template("auth/request-password-reset.html",
+                               errors=get_errors_from_wtform(form),
+                               form=form), 400
 
-                try:
-                    notify_client.send_email(
-                        user.email_address,
-                        template_name_or_id=current_app.config['NOTIFY_TEMPLATES']['reset_password'],
-                        personalisation={
-                            'url': url_for('main.reset_password', token=token, _external=True),
-                        },
-                        reference='reset-password-{}'.format(hash_string(user.email_address)),
-                    )
-                except EmailError as exc:
-                    log_email_error(
-                        exc,
-                        "Password reset",
-                        "login.reset-email.notify-error",
-                        user.email_address,
-                    )
-                    abort(503, "Failed to send password reset email.")
 
-                current_app.logger.info(
-                    "{code}: Sent password reset email for email_hash {email_hash}",
-                    extra={
-                        'email_hash': hash_string(user.email_address),
-                        'code': 'login.reset-email.sent'
-                    }
+def _send_reset_password_email(email_address):
+    """
+    Send whichever reset email is appropriate for this address, returning whether one was sent.
+
+    :raises EmailError: once logged, if the email couldn't be sent
+    """
+    user_json = data_api_client.get_user(email_address=email_address)
+
+    if user_json is not None:
+        user = User.from_json(user_json)
+        if user.role in ("admin-manager",):
+            # if this user wants their password reset they'll have to come to us
+            current_app.logger.warning(
+                "{code}: Password reset requested for {user_role} user '{email_hash}'",
+                extra={
+                    "code": "login.reset-email.bad-role",
+                    "email_hash": hash_string(user.email_address),
+                    "user_role": user.role,
+                }
+            )
+
+        elif user.active:  # specifically checking just .active, ignoring whether account is "locked"
+            token = token_service.generate_reset_password_token(user.id)
+
+            try:
+                email_outbox.send_email(
+                    user.email_address,
+                    template_name_or_id=current_app.config['NOTIFY_TEMPLATES']['reset_password'],
+                    personalisation={
+                        'url': url_for('main.reset_password', token=token, _external=True),
+                    },
+                    reference='reset-password-{}'.format(hash_string(user.email_address)),
                 )
-            else:
-                try:
-                    notify_client.send_email(
-                        user.email_address,
-                        template_name_or_id=current_app.config['NOTIFY_TEMPLATES']['reset_password_inactive'],
-                        reference='reset-password-inactive-{}'.format(hash_string(user.email_address)),
-                    )
-                except EmailError as exc:
-                    log_email_error(
-                        exc,
-                        "Password reset (inactive user)",
-                        "login.reset-email-inactive.notify-error",
-                        user.email_address,
-                    )
-                    abort(503, "Failed to send password reset email.")
-
-                current_app.logger.warning(
-                    "{code}: Sent password (non-)reset email for inactive user email_hash {email_hash}",
-                    extra={
-                        'email_hash': hash_string(user.email_address),
-                        'code': 'login.reset-email-inactive.sent',
-                    }
+            except EmailError as exc:
+                log_email_error(
+                    exc,
+                    "Password reset",
+                    "login.reset-email.notify-error",
+                    user.email_address,
                 )
+                raise
+
+            current_app.logger.info(
+                "{code}: Sent password reset email for email_hash {email_hash}",
+                extra={
+                    'email_hash': hash_string(user.email_address),
+                    'code': 'login.reset-email.sent'
+                }
+            )
+            return True
         else:
-            # Send a email to the Notify sandbox using the 'inactive' template, to mitigate any timing attacks (where
-            # a user's existence could be determined by the response time of this view). Any errors are also handled
-            # in the same way as for inactive users.
             try:
-                notify_client.send_email(
-                    NOTIFY_SANDBOX_ADDRESS,
+                email_outbox.send_email(
+                    user.email_address,
                     template_name_or_id=current_app.config['NOTIFY_TEMPLATES']['reset_password_inactive'],
-                    reference='reset-password-nonexistent-user-{}'.format(hash_string(email_address)),
+                    reference='reset-password-inactive-{}'.format(hash_string(user.email_address)),
                 )
             except EmailError as exc:
                 log_email_error(
                     exc,
-                    "Password reset (non-existent user)",
-                    "login.reset-email-nonexistent.notify-error",
-                    email_address,  # Hashed by the helper function
+                    "Password reset (inactive user)",
+                    "login.reset-email-inactive.notify-error",
+                    user.email_address,
                 )
-                abort(503, "Failed to send password reset email.")
+                raise
 
-            current_app.logger.info(
-                "{code}: Sent password (non-)reset email for invalid user email_hash {email_hash}",
+            current_app.logger.warning(
+                "{code}: Sent password (non-)reset email for inactive user email_hash {email_hash}",
                 extra={
-                    'email_hash': hash_string(email_address),
-                    'code': 'login.reset-email.invalid-email'
+                    'email_hash': hash_string(user.email_address),
+                    'code': 'login.reset-email-inactive.sent',
                 }
             )
-
-        flash(EMAIL_SENT_MESSAGE.format(support_email=current_app.config['SUPPORT_EMAIL_ADDRESS']), "success")
-        return redirect(url_for('.request_password_reset'))
+            return True
     else:
-        return render_template("auth/request-password-reset.html",
-                               errors=get_errors_from_wtform(form),
-                               form=form), 400
+        current_app.logger.info(
+            "{code}: Password reset requested for invalid user email_hash {email_hash}",
+            extra={
+                'email_hash': hash_string(email_address),
+                'code': 'login.reset-email.invalid-email'
+            }
+        )
+
+    return False
 
 
 @main.route('/reset-password/<token>', methods=["GET"])
 def reset_password(token):
-    decoded = decode_password_reset_token(token, data_api_client)
+    decoded = token_service.decode_password_reset_token(token, data_api_client)
     if 'error' in decoded:
         flash(EXPIRED_PASSWORD_RESET_TOKEN_MESSAGE, "error")
         return redirect(url_for('.request_password_reset'))
@@ -176,7 +191,7 @@ def reset_password(token):
 @main.route('/reset-password/<token>', methods=["POST"])
 def update_password(token):
     form = PasswordResetForm()
-    decoded = decode_password_reset_token(token, data_api_client)
+    decoded = token_service.decode_password_reset_token(token, data_api_client)
     if 'error' in decoded:
         flash(EXPIRED_PASSWORD_RESET_TOKEN_MESSAGE, "error")
         return redirect(url_for('.request_password_reset'))
@@ -218,18 +233,10 @@ def change_password():
                 extra={'user_id': current_user.id}
             )
 
-            notify_client = DMNotifyClient(current_app.config['DM_NOTIFY_API_KEY'])
-
-            token = generate_token(
-                {
-                    "user": current_user.id
-                },
-                current_app.config['SHARED_EMAIL_KEY'],
-                current_app.config['RESET_PASSWORD_TOKEN_NS']
-            )
+            token = token_service.generate_reset_password_token(current_user.id)
 
             try:
-                notify_client.send_email(
+                email_outbox.send_email(
                     current_user.email_address,
                     template_name_or_id=current_app.config['NOTIFY_TEMPLATES']['change_password_alert'],
                     personalisation={
@@ -0,0 +1,126 @@
+import os
+import time
+from threading import Lock
+
+import requests
+from gds_metrics.metrics import Counter
+from notifications_python_client import NotificationsAPIClient
+from notifications_python_client.base import logger as notify_logger
+from notifications_python_client.errors import HTTPError
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from dmutils.email import DMNotifyClient
+
+
+NOTIFY_REQUESTS_TOTAL = Counter(
+    'notify_requests_total',
+    'Requests made to Notify through the pooled client',
+)
+
+NOTIFY_CONNECTIONS_OPENED_TOTAL = Counter(
+    'notify_connections_opened_total',
+    'New connections opened to Notify by the pooled client - anything below the request count was a reused connection',
+)
+
+
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _new_conn(self):
+        NOTIFY_CONNECTIONS_OPENED_TOTAL.inc()
+        return super()._new_conn()
+
+
+class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _new_conn(self):
+        NOTIFY_CONNECTIONS_OPENED_TOTAL.inc()
+        return super()._new_conn()
+
+
+class _CountingHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _CountingHTTPConnectionPool,
+            'https': _CountingHTTPSConnectionPool,
+        }
+
+
+class PooledNotificationsAPIClient(NotificationsAPIClient):
+    """
+    `NotificationsAPIClient` that sends its requests through a keep-alive `requests.Session`, rather than opening (and
+    negotiating TLS for) a new connection with every call to `requests.request`.
+    """
+
+    pool_maxsize = 10
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.session = requests.Session()
+        adapter = _CountingHTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _perform_request(self, method, url, kwargs):
+        # mirrors BaseAPIClient._perform_request, which is hard-wired to `requests.request`
+        start_time = time.monotonic()
+        NOTIFY_REQUESTS_TOTAL.inc()
+        try:
+            response = self.session.request(method, url, **kwargs)
+            response.raise_for_status()
+            return response
+        except requests.RequestException as e:
+            api_error = HTTPError.create(e)
+            notify_logger.error(
+                "API {} request on {} failed with {} '{}'".format(
+                    method,
+                    url,
+                    api_error.status_code,
+                    api_error.message
+                )
+            )
+            raise api_error
+        finally:
+            elapsed_time = time.monotonic() - start_time
+            notify_logger.debug("API {} request on {} finished in {}".format(method, url, elapsed_time))
+
+
+class PooledDMNotifyClient(DMNotifyClient):
+    _client_class = PooledNotificationsAPIClient
+
+
+class NotifyClient(object):
+    """
+    Holds one `DMNotifyClient` per worker process, so that Notify connections (and TLS sessions) are kept alive and
+    shared between requests and the email outbox instead of being rebuilt for every email.
+
+    The client is created on first use and again in any process forked after that, as pooled sockets can't be shared
+    with a child process.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._client = None
+        self._client_pid = None
+
+    def init_app(self, app):
+        self._app = app
+        with self._lock:
+            self._client = None
+            self._client_pid = None
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None or self._client_pid != os.getpid():
+                # DMNotifyClient reads templates and redirects from the app config as it's built
+                with self._app.app_context():
+                    self._client = PooledDMNotifyClient(
+                        self._app.config['DM_NOTIFY_API_KEY'],
+                        self._app.config['DM_NOTIFY_API_BASE_URL'],
+                    )
+                self._client_pid = os.getpid()
+            return self._client
+
+    def send_email(self, to_email_address, **kwargs):
+        """Takes the same arguments as `DMNotifyClient.send_email`"""
+        return self.client.send_email(to_email_address, **kwargs)
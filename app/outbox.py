@@ -0,0 +1,341 @@
+import atexit
+import heapq
+import json
+import os
+import sqlite3
+from threading import Condition, Lock, Thread, local
+from time import time
+
+from flask import current_app
+from gds_metrics.metrics import Gauge, Histogram
+
+from dmutils.email.exceptions import EmailError, EmailInvalidError, EmailTemplateError
+from dmutils.email.helpers import hash_string
+
+
+EMAIL_OUTBOX_QUEUE_DEPTH = Gauge(
+    'email_outbox_queue_depth',
+    'Emails waiting in the outbox to be sent to Notify, as last seen by any worker',
+    multiprocess_mode='max',
+)
+
+EMAIL_OUTBOX_DELIVERY_SECONDS = Histogram(
+    'email_outbox_delivery_seconds',
+    'Time from an email being queued in the outbox to Notify accepting it',
+)
+
+# Notify rejecting the email itself won't be fixed by trying again
+PERMANENT_EMAIL_ERRORS = (EmailInvalidError, EmailTemplateError)
+
+
+class EmailOutbox(object):
+    """
+    Sends emails through Notify without holding up the request that asked for them.
+
+    With `DM_EMAIL_OUTBOX_ENABLED` set, `send_email` stores the email and returns straight away; a background thread
+    (started in each worker process on first use) delivers it, retrying failures with exponential backoff. Emails are
+    stored in memory unless `DM_EMAIL_OUTBOX_PATH` names an SQLite database, in which case they survive the process
+    being killed and are delivered by whichever worker next polls the database.
+
+    Otherwise `send_email` sends synchronously, raising `EmailError` just as `DMNotifyClient.send_email` would.
+    """
+
+    def __init__(self, notify_client):
+        self._notify_client = notify_client
+        self.enabled = False
+        self._condition = Condition()
+        self._worker = None
+        self._worker_pid = None
+        self._stopping = False
+        self._registered_atexit = False
+
+    def init_app(self, app):
+        self._app = app
+        self.enabled = app.config['DM_EMAIL_OUTBOX_ENABLED']
+        self.max_attempts = app.config['DM_EMAIL_OUTBOX_MAX_ATTEMPTS']
+        self.retry_backoff = app.config['DM_EMAIL_OUTBOX_RETRY_BACKOFF']
+        self.drain_timeout = app.config['DM_EMAIL_OUTBOX_DRAIN_TIMEOUT']
+        self.batch_size = app.config['DM_EMAIL_OUTBOX_BATCH_SIZE']
+        self.poll_interval = app.config['DM_EMAIL_OUTBOX_POLL_INTERVAL']
+
+        if app.config['DM_EMAIL_OUTBOX_PATH']:
+            self._store = SQLiteOutboxStore(
+                app.config['DM_EMAIL_OUTBOX_PATH'],
+                claim_timeout=app.config['DM_EMAIL_OUTBOX_CLAIM_TIMEOUT'],
+            )
+        else:
+            self._store = MemoryOutboxStore()
+
+    def send_email(self, to_email_address, **kwargs):
+        """
+        Takes the same arguments as `DMNotifyClient.send_email`, and likewise raises `EmailError` if the email can't
+        be sent - or, with the outbox enabled, can't be queued.
+        """
+        if not self.enabled:
+            self._notify_client.send_email(to_email_address, **kwargs)
+            return
+
+        self._ensure_worker()
+        try:
+            self._store.add(to_email_address, kwargs)
+        except Exception as exc:
+            raise EmailError(exc)
+        with self._condition:
+            self._condition.notify()
+
+    def shutdown(self, timeout=None):
+        """Stop accepting new work and wait for queued emails to be delivered"""
+        with self._condition:
+            if self._worker is None:
+                return
+            self._stopping = True
+            self._condition.notify_all()
+
+        self._worker.join(self.drain_timeout if timeout is None else timeout)
+        with self._condition:
+            self._worker = None
+            self._stopping = False
+
+        for email in self._store.abandon():
+            self._app.logger.error(
+                "{code}: Email with reference {reference} was still queued at shutdown and has not been sent",
+                extra={
+                    'code': 'email-outbox.undelivered',
+                    'reference': email.kwargs.get('reference'),
+                    'email_hash': hash_string(email.to_email_address),
+                },
+            )
+
+    def _ensure_worker(self):
+        with self._condition:
+            if self._worker_pid != os.getpid():
+                # anything held in memory (and the thread delivering it) belongs to the process we were forked from
+                self._store.after_fork()
+                self._worker = None
+                self._worker_pid = os.getpid()
+
+            # a worker that died (which it shouldn't - see `_run`) is replaced rather than leaving emails unsent
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = Thread(target=self._run, name='email-outbox', daemon=True)
+                self._worker.start()
+                if not self._registered_atexit:
+                    atexit.register(self.shutdown)
+                    self._registered_atexit = True
+
+    def _run(self):
+        with self._app.app_context():
+            while True:
+                try:
+                    if self._step():
+                        return
+                except Exception as exc:
+                    # such as an SQLite database staying locked - the emails are still queued, so try again later
+                    current_app.logger.error(
+                        "{code}: Email outbox store failed: {error}",
+                        extra={'code': 'email-outbox.store-error', 'error': str(exc)},
+                    )
+                    with self._condition:
+                        self._condition.wait(self.poll_interval)
+
+    def _step(self):
+        """Deliver a batch of emails, or wait for some to be due; returns whether the worker should stop"""
+        batch = self._store.claim(self.batch_size)
+        if batch:
+            self._deliver(batch)
+            return False
+
+        with self._condition:
+            # even a durable store may be on a disk that's about to go, so keep going until everything's sent (or
+            # `shutdown` gives up waiting)
+            if self._stopping and not self._store.depth():
+                return True
+            next_due_at = self._store.next_due_at()
+            self._condition.wait(
+                self.poll_interval if next_due_at is None else
+                max(0, min(next_due_at - time(), self.poll_interval))
+            )
+        return False
+
+    def _deliver(self, batch):
+        finished, retries = [], []
+        for email in batch:
+            try:
+                self._notify_client.send_email(email.to_email_address, **email.kwargs)
+            except Exception as exc:
+                attempts = email.attempts + 1
+                if isinstance(exc, PERMANENT_EMAIL_ERRORS) or attempts >= self.max_attempts:
+                    finished.append(email)
+                    current_app.logger.error(
+                        "{code}: Email with reference {reference} failed to send after {attempts} attempt(s). "
+                        "Error: {error}",
+                        extra={
+                            'code': 'email-outbox.notify-error',
+                            'reference': email.kwargs.get('reference'),
+                            'email_hash': hash_string(email.to_email_address),
+                            'attempts': attempts,
+                            'error': str(exc),
+                        },
+                    )
+                else:
+                    retries.append((email, time() + self.retry_backoff * 2 ** (attempts - 1)))
+                continue
+
+            finished.append(email)
+            EMAIL_OUTBOX_DELIVERY_SECONDS.observe(time() - email.queued_at)
+
+        self._store.finish(finished, retries)
+        EMAIL_OUTBOX_QUEUE_DEPTH.set(self._store.depth())
+
+
+class OutboxEmail(object):
+    def __init__(self, id, to_email_address, kwargs, queued_at, attempts=0):
+        self.id = id
+        self.to_email_address = to_email_address
+        self.kwargs = kwargs
+        self.queued_at = queued_at
+        self.attempts = attempts
+
+
+class MemoryOutboxStore(object):
+    """Keeps queued emails in this process only; anything still queued when the process dies is lost"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._pending = []
+        self._in_flight = 0
+        self._next_id = 0
+
+    def add(self, to_email_address, kwargs):
+        with self._lock:
+            self._next_id += 1
+            email = OutboxEmail(self._next_id, to_email_address, kwargs, queued_at=time())
+            heapq.heappush(self._pending, (email.queued_at, email.id, email))
+
+    def claim(self, limit):
+        with self._lock:
+            batch = []
+            while self._pending and self._pending[0][0] <= time() and len(batch) < limit:
+                batch.append(heapq.heappop(self._pending)[2])
+            self._in_flight += len(batch)
+            return batch
+
+    def finish(self, finished, retries):
+        with self._lock:
+            for email, due_at in retries:
+                email.attempts += 1
+                heapq.heappush(self._pending, (due_at, email.id, email))
+            self._in_flight -= len(finished) + len(retries)
+
+    def next_due_at(self):
+        with self._lock:
+            return self._pending[0][0] if self._pending else None
+
+    def depth(self):
+        with self._lock:
+            return len(self._pending) + self._in_flight
+
+    def abandon(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+            return [email for _, _, email in pending]
+
+    def after_fork(self):
+        self._lock = Lock()
+        self._pending = []
+        self._in_flight = 0
+
+
+class SQLiteOutboxStore(object):
+    """
+    Keeps queued emails in an SQLite database shared by every worker process on the host.
+
+    The database runs in WAL mode so that request threads adding emails aren't blocked by the delivery loop. Emails are
+    claimed, and their results recorded, a batch at a time in a single transaction. A claim that isn't finished
+    within `claim_timeout` seconds (because the worker holding it died) lapses, and the email is sent again.
+    """
+
+    def __init__(self, path, claim_timeout):
+        self.path = path
+        self.claim_timeout = claim_timeout
+        self._local = local()
+        self._connection().execute(
+            """
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY,
+                to_email_address TEXT NOT NULL,
+                kwargs TEXT NOT NULL,
+                queued_at REAL NOT NULL,
+                due_at REAL NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                claimed_at REAL
+            )
+            """
+        )
+        self._connection().execute("CREATE INDEX IF NOT EXISTS outbox_due_at ON outbox (due_at)")
+
+    def _connection(self):
+        # sqlite connections can't be shared between threads, or carried across a fork
+        if getattr(self._local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return self._local.connection
+
+    def add(self, to_email_address, kwargs):
+        now = time()
+        self._connection().execute(
+            "INSERT INTO outbox (to_email_address, kwargs, queued_at, due_at) VALUES (?, ?, ?, ?)",
+            (to_email_address, json.dumps(kwargs), now, now),
+        )
+
+    def claim(self, limit):
+        connection = self._connection()
+        now = time()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            rows = connection.execute(
+                """
+                SELECT id, to_email_address, kwargs, queued_at, attempts FROM outbox
+                WHERE due_at <= ? AND (claimed_at IS NULL OR claimed_at < ?)
+                ORDER BY due_at LIMIT ?
+                """,
+                (now, now - self.claim_timeout, limit),
+            ).fetchall()
+            connection.executemany("UPDATE outbox SET claimed_at = ? WHERE id = ?", [(now, row[0]) for row in rows])
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+        return [
+            OutboxEmail(id, to_email_address, json.loads(kwargs), queued_at, attempts)
+            for id, to_email_address, kwargs, queued_at, attempts in rows
+        ]
+
+    def finish(self, finished, retries):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany("DELETE FROM outbox WHERE id = ?", [(email.id,) for email in finished])
+            connection.executemany(
+                "UPDATE outbox SET due_at = ?, attempts = attempts + 1, claimed_at = NULL WHERE id = ?",
+                [(due_at, email.id) for email, due_at in retries],
+            )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def next_due_at(self):
+        return self._connection().execute("SELECT MIN(due_at) FROM outbox WHERE claimed_at IS NULL").fetchone()[0]
+
+    def depth(self):
+        return self._connection().execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def abandon(self):
+        # nothing is lost - it will be picked up when a worker next polls the database
+        return []
+
+    def after_fork(self):
+        pass
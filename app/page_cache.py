@@ -0,0 +1,63 @@
+from flask import current_app, g, request, session
+from flask_login import current_user
+from flask_wtf.csrf import generate_csrf
+
+from dmutils.flask import timed_render_template as render_template
+
+from .caching import ExpiringLRUCache
+
+
+CSRF_TOKEN_PLACEHOLDER = '__dm_page_cache_csrf_token__'
+
+
+class RenderedPageCache(object):
+    """
+    Keeps the rendered HTML of pages that are the same for every anonymous visitor, so that they needn't be rendered
+    again for each request.
+
+    Pages are cached per route and whatever else the view says they vary on - including any query args that affect
+    the page, as the rest of the query string is ignored so that junk in it can't fill the cache with copies of the
+    same page. The only per-visitor part
+    of such a page is its CSRF token, which is swapped for a placeholder in the stored copy and filled in with the
+    visitor's own token whenever it's served. Pages are never cached (or served from the cache) for logged in users,
+    for requests other than GETs or when there are flashed messages waiting to be shown.
+
+    Like the other in-process caches this is per-worker. A `DM_PAGE_CACHE_SIZE` of 0 turns it off.
+    """
+
+    def __init__(self):
+        self._cache = ExpiringLRUCache(maxsize=0, ttl=0)
+
+    def init_app(self, app):
+        self._cache = ExpiringLRUCache(
+            maxsize=app.config['DM_PAGE_CACHE_SIZE'],
+            ttl=app.config['DM_PAGE_CACHE_TTL'],
+            name='rendered_pages',
+        )
+
+    def render_template(self, template_name_or_list, vary_on=(), **context):
+        """
+        Render a template as `flask.render_template` would, or return the cached page for this request.
+
+        :param vary_on: a tuple of anything other than the request's path (such as query args) that affects the page
+        """
+        if not self._is_cacheable():
+            return render_template(template_name_or_list, **context)
+
+        key = (request.endpoint, request.path, tuple(vary_on))
+        page = self._cache.get(key)
+        if page is not None:
+            return page.replace(CSRF_TOKEN_PLACEHOLDER, generate_csrf()) if CSRF_TOKEN_PLACEHOLDER in page else page
+
+        page = render_template(template_name_or_list, **context)
+        csrf_token = g.get(current_app.config.get('WTF_CSRF_FIELD_NAME', 'csrf_token'))
+        self._cache.set(key, page.replace(csrf_token, CSRF_TOKEN_PLACEHOLDER) if csrf_token else page)
+        return page
+
+    def _is_cacheable(self):
+        return (
+            self._cache.maxsize > 0
+            and request.method == 'GET'
+            and not current_user.is_authenticated
+            and not session.get('_flashes')
+        )
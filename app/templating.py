@@ -0,0 +1,474 @@
+import os
+import tempfile
+from functools import partial
+from hashlib import sha256
+from importlib import metadata
+from threading import local
+from time import perf_counter
+
+import jinja2
+import jinja2.ext
+from dmutils.flask import SLOW_RENDER_THRESHOLD
+from dmutils.timing import logged_duration
+from flask import current_app, g, has_app_context, stream_with_context
+from flask.signals import before_render_template, template_rendered
+from gds_metrics.metrics import Counter, Histogram
+
+from .caching import ExpiringLRUCache
+
+
+def _package_version(name):
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return 'unknown'
+
+
+# Compiled templates depend on more than their source: govuk-frontend-jinja rewrites the Nunjucks templates before
+# Jinja compiles them, and Jinja's own checksums only cover the source as read from disk.
+TEMPLATE_TOOLCHAIN_VERSION = 'jinja2-{}|govuk-frontend-jinja-{}'.format(
+    _package_version('jinja2'), _package_version('govuk-frontend-jinja')
+)
+
+
+TEMPLATE_TRANSFORM_SECONDS = Histogram(
+    'template_transform_seconds',
+    'Time spent transforming template source (such as Nunjucks into Jinja) before compiling it',
+    ['cache'],
+)
+
+TEMPLATE_COMPILE_SECONDS = Histogram(
+    'template_compile_seconds',
+    'Time spent compiling templates, not counting transformation of their source',
+)
+
+TEMPLATE_RENDER_SECONDS = Histogram(
+    'template_render_seconds',
+    'Time spent rendering each template, including templates it extends or includes (with DM_TEMPLATE_PROFILING)',
+    ['template'],
+)
+
+TEMPLATE_MACRO_SECONDS = Histogram(
+    'template_macro_seconds',
+    'Time spent in each call of an imported template macro (with DM_TEMPLATE_PROFILING)',
+    ['macro'],
+)
+
+# streamed pages are sent in chunks of at least this many characters, apart from the document head which is sent as
+# soon as it has been rendered
+STREAM_CHUNK_SIZE = 8192
+
+# number of templates and macros listed (slowest first) in each request's template profile
+TEMPLATE_PROFILE_REPORT_SIZE = 20
+
+TEMPLATE_FRAGMENT_SECONDS_SAVED = Counter(
+    'template_fragment_seconds_saved_total',
+    'Time that rendering template fragments served from the fragment cache took when they were cached',
+)
+
+
+class VersionedFileSystemBytecodeCache(jinja2.FileSystemBytecodeCache):
+    """
+    A `FileSystemBytecodeCache` that can be shared by several worker processes and shipped read-only in an image.
+
+    Cache keys include the template toolchain's versions, so upgrading either package can't serve stale bytecode.
+    Files are written atomically, so one worker can't read another's half-written file, and failures to write (for
+    example to a read-only directory) are ignored, as the template has been compiled regardless.
+    """
+
+    def get_cache_key(self, name, filename=None):
+        return super().get_cache_key('{}|{}'.format(TEMPLATE_TOOLCHAIN_VERSION, name), filename)
+
+    def dump_bytecode(self, bucket):
+        _write_atomically(self.directory, self._get_cache_filename(bucket), bucket.bytecode_to_string())
+
+
+class IndexedFileSystemLoader(jinja2.FileSystemLoader):
+    """
+    A `FileSystemLoader` that finds templates with a lookup in an index of every file in its search path, built the
+    first time it's used, rather than trying to open each template (and every macro it imports) in each directory
+    in turn. As with `FileSystemLoader`, the first directory a template is found in wins.
+
+    Unless the environment is set to auto-reload, templates aren't checked for changes once loaded. If it is (as
+    in development) they are, and the index is rebuilt when a template can't be found, so new ones are picked up.
+    """
+
+    def __init__(self, searchpath, encoding='utf-8', followlinks=False):
+        super().__init__(searchpath, encoding, followlinks)
+        self._index = None
+
+    def _build_index(self):
+        index = {}
+        for searchpath in self.searchpath:
+            for dirpath, _, filenames in os.walk(searchpath, followlinks=self.followlinks):
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+                    index.setdefault(os.path.relpath(path, searchpath).replace(os.path.sep, '/'), path)
+        self._index = index
+        return index
+
+    def _find(self, environment, template):
+        name = '/'.join(jinja2.loaders.split_template_path(template))
+        filename = (self._index if self._index is not None else self._build_index()).get(name)
+        if filename is None and environment.auto_reload:
+            filename = self._build_index().get(name)
+        if filename is None:
+            raise jinja2.TemplateNotFound(template)
+        return filename
+
+    def get_source(self, environment, template):
+        filename = self._find(environment, template)
+        try:
+            with open(filename, 'rb') as f:
+                contents = f.read().decode(self.encoding)
+        except FileNotFoundError:
+            raise jinja2.TemplateNotFound(template)
+
+        if not environment.auto_reload:
+            return contents, filename, None
+
+        mtime = os.path.getmtime(filename)
+
+        def uptodate():
+            try:
+                return os.path.getmtime(filename) == mtime
+            except OSError:
+                return False
+
+        return contents, filename, uptodate
+
+    def list_templates(self):
+        return sorted(self._index if self._index is not None else self._build_index())
+
+
+class TemplateTransformCache(object):
+    """
+    Remembers the output of the Jinja environment's `preprocess` step - where govuk-frontend-jinja rewrites Nunjucks
+    templates into Jinja - keyed by a hash of the template's name and source, so that a template is transformed once
+    rather than again every time it's recompiled. Results are kept in memory and, if `directory` is given, on disk
+    for other workers and later restarts.
+
+    Also records how long is spent transforming and compiling templates in the `template_transform_seconds` and
+    `template_compile_seconds` metrics (the latter not counting the transformation).
+    """
+
+    def __init__(self, environment, directory=None):
+        self.directory = directory
+        self._transformed = {}
+        self._local = local()
+
+        self._preprocess = environment.preprocess
+        self._compile = environment.compile
+        environment.preprocess = self.preprocess
+        environment.compile = self.compile
+
+    def preprocess(self, source, name=None, filename=None):
+        started_at = perf_counter()
+        key = sha256(
+            '\0'.join((TEMPLATE_TOOLCHAIN_VERSION, name or '', filename or '', source)).encode('utf-8')
+        ).hexdigest()
+
+        result = 'hit'
+        transformed = self._transformed.get(key)
+        if transformed is None and self.directory:
+            transformed = self._load(key)
+        if transformed is None:
+            result = 'miss'
+            transformed = self._preprocess(source, name, filename)
+            if self.directory:
+                _write_atomically(self.directory, self._filename(key), transformed.encode('utf-8'))
+        self._transformed[key] = transformed
+
+        elapsed = perf_counter() - started_at
+        self._local.transform_seconds = getattr(self._local, 'transform_seconds', 0) + elapsed
+        TEMPLATE_TRANSFORM_SECONDS.labels(result).observe(elapsed)
+        return transformed
+
+    def compile(self, source, name=None, filename=None, raw=False, defer_init=False):
+        self._local.transform_seconds = 0
+        started_at = perf_counter()
+        try:
+            return self._compile(source, name, filename, raw, defer_init)
+        finally:
+            TEMPLATE_COMPILE_SECONDS.observe(perf_counter() - started_at - self._local.transform_seconds)
+
+    def _filename(self, key):
+        return os.path.join(self.directory, key + '.jinja')
+
+    def _load(self, key):
+        try:
+            with open(self._filename(key), 'rb') as f:
+                return f.read().decode('utf-8')
+        except OSError:
+            return None
+
+
+class FragmentCacheExtension(jinja2.ext.Extension):
+    """
+    Adds a `{% cache key[, ttl] %}...{% endcache %}` tag, which renders its body once per key and serves it from the
+    environment's `fragment_cache` until it expires, after `ttl` seconds or the cache's own TTL.
+
+    Fragments are cached separately for each template the tag is in and each template being rendered, as a layout's
+    fragment may contain blocks that the page extending it overrides. The key must cover everything else the body
+    depends on. Each time a cached fragment is used, the time it originally
+    took to render is added to the `template_fragment_seconds_saved_total` metric.
+    """
+
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=ExpiringLRUCache(maxsize=0, ttl=0))
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [jinja2.nodes.Const(parser.name), jinja2.nodes.ContextReference(), parser.parse_expression()]
+        args.append(parser.parse_expression() if parser.stream.skip_if('comma') else jinja2.nodes.Const(None))
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return jinja2.nodes.CallBlock(self.call_method('_render_cached', args), [], [], body).set_lineno(lineno)
+
+    def _render_cached(self, template_name, context, key, ttl, caller):
+        cache = self.environment.fragment_cache
+        # the context's name is that of the template being rendered, even while rendering the layout it extends
+        key = (template_name, context.name, key)
+        cached = cache.get(key)
+        if cached is not None:
+            fragment, render_seconds = cached
+            TEMPLATE_FRAGMENT_SECONDS_SAVED.inc(render_seconds)
+            return fragment
+
+        started_at = perf_counter()
+        fragment = caller()
+        cache.set(key, (fragment, perf_counter() - started_at), ttl)
+        return fragment
+
+
+class ProfiledTemplate(jinja2.Template):
+    """
+    A template that records how long it takes to render, and how long each macro imported from it takes to run, in
+    the `template_render_seconds` and `template_macro_seconds` metrics and in the current request's template profile.
+
+    Times are cumulative, so include time spent in other templates and macros used along the way.
+    """
+
+    @classmethod
+    def _from_namespace(cls, environment, namespace, globals):
+        template = super()._from_namespace(environment, namespace, globals)
+        template.root_render_func = _timed_render_func(template.root_render_func, template.name or '<string>')
+        return template
+
+    def make_module(self, vars=None, shared=False, locals=None):
+        module = super().make_module(vars, shared, locals)
+        for name, value in list(module.__dict__.items()):
+            if isinstance(value, jinja2.runtime.Macro):
+                setattr(module, name, _timed_macro(value))
+        return module
+
+
+def _timed_render_func(render_func, template_name):
+    def timed_render_func(context):
+        chunks = render_func(context)
+        elapsed = 0
+        try:
+            while True:
+                started_at = perf_counter()
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed += perf_counter() - started_at
+                yield chunk
+        finally:
+            _record_template_time(TEMPLATE_RENDER_SECONDS, 'template', template_name, elapsed)
+
+    return timed_render_func
+
+
+def _timed_macro(macro):
+    # marked as an evalcontextfunction, like `Macro.__call__`, so that it gets (and passes on) the caller's
+    # autoescaping setting
+    @jinja2.evalcontextfunction
+    def timed_macro(*args, **kwargs):
+        started_at = perf_counter()
+        try:
+            return macro(*args, **kwargs)
+        finally:
+            _record_template_time(TEMPLATE_MACRO_SECONDS, 'macro', macro.name, perf_counter() - started_at)
+
+    return timed_macro
+
+
+def _record_template_time(histogram, kind, name, seconds):
+    histogram.labels(name).observe(seconds)
+    if has_app_context():
+        totals = g.setdefault('template_profile', {}).setdefault((kind, name), [0, 0.0])
+        totals[0] += 1
+        totals[1] += seconds
+
+
+def _log_template_profile(exception=None):
+    profile = g.pop('template_profile', None)
+    if not profile:
+        return
+
+    slowest = sorted(profile.items(), key=lambda item: item[1][1], reverse=True)[:TEMPLATE_PROFILE_REPORT_SIZE]
+    current_app.logger.info(
+        "Template profile: {template_profile}",
+        extra={'template_profile': "; ".join(
+            "{} {}: {} calls, {:.1f}ms".format(kind, name, count, seconds * 1000)
+            for (kind, name), (count, seconds) in slowest
+        )},
+    )
+
+
+def _write_atomically(directory, filename, data):
+    """Write `data` to `filename` so that readers never see part of it, ignoring failures to write"""
+    try:
+        fd, temporary_filename = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    except OSError:
+        return
+
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temporary_filename, filename)
+    except OSError:
+        try:
+            os.remove(temporary_filename)
+        except OSError:
+            pass
+
+
+_logged_stream_duration = partial(
+    logged_duration,
+    message="Spent {duration_real}s in stream_template",
+    condition=lambda log_context: (
+        logged_duration.default_condition(log_context) or log_context["duration_real"] > SLOW_RENDER_THRESHOLD
+    ),
+)
+
+
+def stream_template(template_name_or_list, **context):
+    """
+    Render a template as an iterator of chunks of the page, to be used as the body of a response, so that the browser
+    gets the document head (and can start fetching stylesheets) before the rest of the page has been rendered.
+
+    Like Flask's `render_template`, this sends the `before_render_template` and `template_rendered` signals - the
+    first straight away, as Flask 2.2's `stream_template` does, so that receivers can still change the response's
+    headers - and like `dmutils.flask.timed_render_template` logs the time spent if the request is sampled or rendering
+    was slow (here, from the start of rendering until the last chunk has been sent).
+    """
+    app = current_app._get_current_object()
+    template = app.jinja_env.get_or_select_template(template_name_or_list)
+    app.update_template_context(context)
+    before_render_template.send(app, template=template, context=context)
+
+    def generate():
+        with _logged_stream_duration():
+            yield from _chunked(template.generate(context))
+            template_rendered.send(app, template=template, context=context)
+
+    return stream_with_context(generate())
+
+
+def _chunked(fragments):
+    buffer, buffered = [], 0
+    head_sent = False
+    for fragment in fragments:
+        buffer.append(fragment)
+        buffered += len(fragment)
+        end_of_head = not head_sent and '</head>' in fragment
+        if end_of_head or buffered >= STREAM_CHUNK_SIZE:
+            head_sent = head_sent or end_of_head
+            yield ''.join(buffer)
+            buffer, buffered = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def init_template_bytecode_cache(app):
+    """Have the app's Jinja environment keep compiled templates in `DM_TEMPLATE_BYTECODE_CACHE_DIR`, if set"""
+    directory = app.config['DM_TEMPLATE_BYTECODE_CACHE_DIR']
+    if not directory:
+        return
+
+    try:
+        os.makedirs(directory, exist_ok=True)
+    except OSError as e:
+        app.logger.warning(
+            "Template bytecode cache directory {directory} is unavailable: {error}",
+            extra={'directory': directory, 'error': str(e)},
+        )
+        return
+
+    app.jinja_env.bytecode_cache = VersionedFileSystemBytecodeCache(directory)
+
+
+def init_compiled_templates(app):
+    """
+    Load templates from the Python modules `scripts/compile_templates.py` wrote to `DM_COMPILED_TEMPLATES_DIR`, if set,
+    falling back to the usual loader for any that weren't compiled.
+
+    Compiled templates are never checked against their source, so they must be rebuilt whenever the templates change.
+    """
+    directory = app.config['DM_COMPILED_TEMPLATES_DIR']
+    if not directory:
+        return
+
+    if not os.path.isdir(directory):
+        app.logger.warning(
+            "Compiled templates directory {directory} does not exist - templates will be compiled at runtime",
+            extra={'directory': directory},
+        )
+        return
+
+    # set on the environment rather than as `app.jinja_loader`, because Flask's dispatching loader only asks its
+    # loaders for template source, which a ModuleLoader doesn't have
+    app.jinja_env.loader = jinja2.ChoiceLoader([jinja2.ModuleLoader(directory), app.jinja_env.loader])
+
+
+def init_template_transform_cache(app):
+    directory = app.config['DM_TEMPLATE_TRANSFORM_CACHE_DIR']
+    if directory:
+        try:
+            os.makedirs(directory, exist_ok=True)
+        except OSError as e:
+            app.logger.warning(
+                "Template transform cache directory {directory} is unavailable: {error}",
+                extra={'directory': directory, 'error': str(e)},
+            )
+            directory = None
+
+    TemplateTransformCache(app.jinja_env, directory)
+
+
+def init_template_fragment_cache(app):
+    """Add the `{% cache %}` tag, keeping fragments in a per-worker cache of `DM_TEMPLATE_FRAGMENT_CACHE_SIZE`"""
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    app.jinja_env.fragment_cache = ExpiringLRUCache(
+        maxsize=app.config['DM_TEMPLATE_FRAGMENT_CACHE_SIZE'],
+        ttl=app.config['DM_TEMPLATE_FRAGMENT_CACHE_TTL'],
+        name='template_fragments',
+    )
+
+
+def init_template_profiling(app):
+    """
+    With `DM_TEMPLATE_PROFILING` set, record render times of templates and macros, and with
+    `DM_TEMPLATE_PROFILING_REPORT` set too, log the slowest of them at the end of each request.
+    """
+    if not app.config['DM_TEMPLATE_PROFILING']:
+        return
+
+    app.jinja_env.template_class = ProfiledTemplate
+    if app.config['DM_TEMPLATE_PROFILING_REPORT']:
+        app.teardown_request(_log_template_profile)
+
+
+def init_templating(app):
+    init_template_profiling(app)
+    init_template_fragment_cache(app)
+    init_compiled_templates(app)
+    init_template_bytecode_cache(app)
+    init_template_transform_cache(app)
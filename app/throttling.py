@@ -0,0 +1,31 @@
+from dmutils.email.helpers import hash_string
+
+from .caching import ExpiringLRUCache
+
+
+class ResetPasswordRequestSuppressor(object):
+    """
+    Remembers (by hash) which email addresses have asked for a password reset recently, so that repeated requests
+    within `DM_RESET_PASSWORD_SUPPRESSION_WINDOW` seconds don't each cost a Data API lookup and a Notify send.
+
+    Every address is treated the same whether or not it belongs to an account, so being suppressed reveals nothing
+    about which addresses are registered. Like the other in-process caches this is per-worker, so a determined client
+    can still get one email per worker per window.
+    """
+
+    def __init__(self):
+        self._cache = ExpiringLRUCache(maxsize=0, ttl=0)
+
+    def init_app(self, app):
+        self._cache = ExpiringLRUCache(
+            maxsize=app.config['DM_RESET_PASSWORD_SUPPRESSION_SIZE'],
+            ttl=app.config['DM_RESET_PASSWORD_SUPPRESSION_WINDOW'],
+            name='reset_password_requests',
+        )
+
+    def should_send(self, email_address):
+        """Whether a reset email should be sent for this request, recording that one has been if so"""
+        return self._cache.add(hash_string(email_address), True)
+
+    def forget(self, email_address):
+        self._cache.pop(hash_string(email_address))
@@ -0,0 +1,67 @@
+from collections import deque
+from contextlib import contextmanager
+from threading import Lock
+from time import monotonic, sleep
+
+from gds_metrics.metrics import Histogram
+
+
+RESPONSE_PADDING_SECONDS = Histogram(
+    'response_padding_seconds',
+    'Time added to responses so that their duration does not depend on which path the request took',
+    ['timer'],
+)
+
+
+class ResponseTimeEqualiser(object):
+    """
+    Pads responses to a target duration, so that how long a view takes doesn't reveal which branch it went down (for
+    example, whether an email address belongs to an account).
+
+    The target is a percentile of how long the slowest branch has recently taken in this worker, clamped between the
+    configured minimum and maximum. Setting the maximum to 0 turns padding off.
+    """
+
+    def __init__(self, name, config_prefix):
+        self.name = name
+        self.config_prefix = config_prefix
+        self.min_duration = self.max_duration = 0
+        self._samples = deque()
+        self._lock = Lock()
+
+    def init_app(self, app):
+        # dmutils only converts environment overrides to bools and ints, so fractional seconds arrive as strings
+        self.min_duration = float(app.config[self.config_prefix + '_MIN_RESPONSE_TIME'])
+        self.max_duration = float(app.config[self.config_prefix + '_MAX_RESPONSE_TIME'])
+        self.percentile = float(app.config[self.config_prefix + '_RESPONSE_TIME_PERCENTILE'])
+        self._samples = deque(maxlen=int(app.config[self.config_prefix + '_RESPONSE_TIME_SAMPLES']))
+
+    def record(self, duration):
+        """Record how long the slowest branch took"""
+        with self._lock:
+            self._samples.append(duration)
+
+    def target(self):
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return self.min_duration
+
+        observed = samples[min(len(samples) - 1, int(len(samples) * self.percentile / 100))]
+        return min(max(observed, self.min_duration), self.max_duration)
+
+    @contextmanager
+    def equalise(self):
+        """
+        Pads the duration of the `with` block (even if it raises) up to the current target. The block is given a
+        function to call once the slowest branch has done its work, recording how long that took.
+        """
+        started_at = monotonic()
+        try:
+            yield lambda: self.record(monotonic() - started_at)
+        finally:
+            if self.max_duration > 0:
+                padding = max(0, self.target() - (monotonic() - started_at))
+                RESPONSE_PADDING_SECONDS.labels(self.name).observe(padding)
+                if padding:
+                    sleep(padding)
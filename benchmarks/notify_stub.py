@@ -0,0 +1,120 @@
+"""
+A local stand-in for the GOV.UK Notify API, for exercising the app's emails without sending anything.
+
+It accepts any API key, answers `POST /v2/notifications/email` with a plausible notification and
+`GET /v2/notifications` with an empty list, and can be made slow or unreliable. Point the app at it with
+
+    DM_NOTIFY_API_BASE_URL=http://localhost:6011
+
+Usage:
+
+    python -m benchmarks.notify_stub [--port PORT] [--latency MS] [--jitter MS] [--error-rate FRACTION]
+"""
+import argparse
+import json
+import random
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock
+
+
+class NotifyStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, jitter=0.0, error_rate=0.0, error_status=500):
+        super().__init__(address, _NotifyStubHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.emails_sent = 0
+        self.errors_returned = 0
+        self._lock = Lock()
+
+    @property
+    def url(self):
+        return 'http://{}:{}'.format(*self.server_address)
+
+
+class _NotifyStubHandler(BaseHTTPRequestHandler):
+    # keep connections open, as Notify does, so that client-side connection pooling makes a difference
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path.split('?')[0] == '/v2/notifications':
+            self._respond(200, {'notifications': [], 'links': {}})
+        else:
+            self._respond(404, _errors(404, 'AuthError', 'Not found'))
+
+    def do_POST(self):
+        request_body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if self.path != '/v2/notifications/email':
+            self._respond(404, _errors(404, 'AuthError', 'Not found'))
+            return
+
+        server = self.server
+        time.sleep(max(0.0, server.latency + random.uniform(-server.jitter, server.jitter)))
+
+        if random.random() < server.error_rate:
+            with server._lock:
+                server.errors_returned += 1
+            self._respond(server.error_status, _errors(server.error_status, 'Exception', 'Injected error'))
+            return
+
+        with server._lock:
+            server.emails_sent += 1
+        notification_id = str(uuid.uuid4())
+        self._respond(201, {
+            'id': notification_id,
+            'reference': request_body.get('reference'),
+            'content': {'subject': 'Stub email', 'body': 'Stub email', 'from_email': 'stub@notifications.invalid'},
+            'uri': '{}/v2/notifications/{}'.format(server.url, notification_id),
+            'template': {
+                'id': request_body.get('template_id'),
+                'version': 1,
+                'uri': '{}/v2/template/{}'.format(server.url, request_body.get('template_id')),
+            },
+        })
+
+    def _respond(self, status, body):
+        encoded = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def log_message(self, *args):
+        pass
+
+
+def _errors(status_code, error, message):
+    return {'status_code': status_code, 'errors': [{'error': error, 'message': message}]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=6011, help="port to listen on (default: %(default)s)")
+    parser.add_argument("--latency", type=float, default=100, help="ms to wait before answering a send")
+    parser.add_argument("--jitter", type=float, default=0, help="ms of random variation in the latency")
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction of sends that fail (0-1)")
+    parser.add_argument("--error-status", type=int, default=500, help="status code for failed sends")
+    args = parser.parse_args()
+
+    server = NotifyStubServer(
+        ('127.0.0.1', args.port),
+        latency=args.latency / 1000,
+        jitter=args.jitter / 1000,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+    )
+    print(f"Notify stand-in listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Measure throughput and latency of the password reset and change flows, with Notify replaced by the local stand-in
+from `benchmarks.notify_stub` (started in-process, with the given latency and error rate).
+
+The app runs in-process behind a threaded werkzeug server, using the development config with CSRF turned off and
+cookie sessions instead of Redis. Data API calls are answered with canned responses, so the only external latency
+is Notify's. Every reset request uses a different email address, so none are suppressed as repeats.
+
+Usage:
+
+    python -m benchmarks.reset_flow [--flow reset|change] [--requests N] [--concurrency C]
+        [--notify-latency MS] [--notify-error-rate FRACTION] [--outbox] [--pad-responses]
+"""
+import argparse
+import itertools
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread, local
+from unittest import mock
+
+import requests
+from werkzeug.serving import make_server
+
+from benchmarks.notify_stub import NotifyStubServer
+
+PASSWORD = "benchmark-password-0123"
+
+
+def _user(user_id, email_address):
+    return {
+        'users': {
+            'id': user_id,
+            'emailAddress': email_address,
+            'name': 'Benchmark User',
+            'role': 'buyer',
+            'locked': False,
+            'active': True,
+            'passwordChangedAt': '2020-01-01T00:00:00.000000Z',
+            'userResearchOptedIn': True,
+        }
+    }
+
+
+def _get_user(user_id=None, email_address=None):
+    return _user(user_id or 1, email_address or 'user-{}@example.com'.format(user_id))
+
+
+def _percentile(durations, percentile):
+    return durations[min(len(durations) - 1, int(len(durations) * percentile / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--flow", choices=("reset", "change"), default="reset", help="flow to drive")
+    parser.add_argument("--requests", type=int, default=500, help="requests to make (default: %(default)s)")
+    parser.add_argument("--concurrency", type=int, default=8, help="requests in flight (default: %(default)s)")
+    parser.add_argument("--notify-latency", type=float, default=150, help="ms Notify takes to accept an email")
+    parser.add_argument("--notify-error-rate", type=float, default=0, help="fraction of Notify sends that fail")
+    parser.add_argument("--outbox", action="store_true", help="queue emails in the outbox rather than sending inline")
+    parser.add_argument("--pad-responses", action="store_true", help="keep reset-password response time padding on")
+    args = parser.parse_args()
+
+    notify = NotifyStubServer(
+        ('127.0.0.1', 0), latency=args.notify_latency / 1000, error_rate=args.notify_error_rate
+    )
+    Thread(target=notify.serve_forever, daemon=True).start()
+
+    os.environ.update(
+        DM_NOTIFY_API_BASE_URL=notify.url,
+        DM_EMAIL_OUTBOX_ENABLED=str(args.outbox),
+        DM_RESET_PASSWORD_MAX_RESPONSE_TIME="3" if args.pad_responses else "0",
+        WTF_CSRF_ENABLED="false",
+        DM_LOG_LEVEL="ERROR",
+    )
+
+    with mock.patch('dmutils.session.init_app'):
+        from app import create_app, data_api_client, email_outbox
+        app = create_app('development')
+
+    data_api_client.get_user = _get_user
+    data_api_client.authenticate_user = lambda email_address, password: _user(1, email_address)
+    data_api_client.update_user_password = lambda *args, **kwargs: True
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    Thread(target=server.serve_forever, daemon=True).start()
+    base_url = 'http://127.0.0.1:{}/user'.format(server.server_port)
+
+    sessions = local()
+    counter = itertools.count()
+
+    def session():
+        if not hasattr(sessions, 'session'):
+            sessions.session = requests.Session()
+            if args.flow == 'change':
+                sessions.session.post(
+                    base_url + '/login',
+                    data={'email_address': 'user-1@example.com', 'password': PASSWORD},
+                    allow_redirects=False,
+                ).raise_for_status()
+        return sessions.session
+
+    def one_request(_):
+        client = session()
+        started_at = time.perf_counter()
+        if args.flow == 'reset':
+            response = client.post(
+                base_url + '/reset-password',
+                data={'email_address': 'user-{}@example.com'.format(next(counter))},
+                allow_redirects=False,
+            )
+        else:
+            response = client.post(
+                base_url + '/change-password',
+                data={'old_password': PASSWORD, 'password': PASSWORD, 'confirm_password': PASSWORD},
+                allow_redirects=False,
+            )
+        return time.perf_counter() - started_at, response.status_code
+
+    with ThreadPoolExecutor(args.concurrency) as executor:
+        started_at = time.perf_counter()
+        results = list(executor.map(one_request, range(args.requests)))
+        elapsed = time.perf_counter() - started_at
+
+    email_outbox.shutdown(timeout=60)
+    server.shutdown()
+    notify.shutdown()
+
+    durations = sorted(duration for duration, _ in results)
+    failures = sum(1 for _, status in results if status != 302)
+    print(
+        f"flow={args.flow} requests={args.requests} concurrency={args.concurrency} outbox={args.outbox} "
+        f"notify_latency={args.notify_latency:.0f}ms notify_error_rate={args.notify_error_rate}"
+    )
+    print(f"throughput: {len(results) / elapsed:.1f} req/s  non-redirect responses: {failures}")
+    print(
+        f"latency ms: mean {statistics.mean(durations) * 1000:.1f}  "
+        + "  ".join(f"p{p} {_percentile(durations, p) * 1000:.1f}" for p in (50, 95, 99))
+    )
+    print(f"Notify stand-in: {notify.emails_sent} emails accepted, {notify.errors_returned} errors injected")
+
+
+if __name__ == "__main__":
+    main()
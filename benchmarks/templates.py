@@ -0,0 +1,187 @@
+"""
+Measure the cost of rendering each of the app's page templates, with contexts like those the views build, in both
+their normal and error states.
+
+For each case the template is rendered repeatedly inside a single request context, reporting renders per second and
+the peak memory allocated during a render (as traced by `tracemalloc`). Run it before and after upgrading templates or
+govuk-frontend to see whether page render cost has changed.
+
+The app uses the development config with CSRF turned off (so that submitted forms validate without tokens) and
+cookie sessions instead of Redis. Caching of template fragments is off unless `--fragment-cache` is given.
+
+Usage:
+
+    python -m benchmarks.templates [--number N] [--fragment-cache] [--only NAME]
+"""
+import argparse
+import os
+import timeit
+import tracemalloc
+from functools import partial
+from unittest import mock
+
+from flask import render_template
+from flask_login import login_user
+
+from dmutils.forms.errors import get_errors_from_wtform, govuk_errors
+from dmutils.user import User
+
+from app.main.forms.auth_forms import (
+    CreateUserForm,
+    EmailAddressForm,
+    LoginForm,
+    PasswordChangeForm,
+    PasswordResetForm,
+)
+from app.main.forms.user_research import UserResearchOptInForm
+from app.main.views.auth import NO_ACCOUNT_MESSAGE
+
+
+def _user(role='buyer', **kwargs):
+    user_json = {
+        'id': 1,
+        'emailAddress': 'user@example.com',
+        'name': 'Benchmark User',
+        'role': role,
+        'locked': False,
+        'active': True,
+        'userResearchOptedIn': True,
+    }
+    user_json.update(kwargs)
+    if role == 'supplier':
+        user_json['supplier'] = {'supplierId': 1234, 'name': 'Benchmark Supplier'}
+    return User.from_json({'users': user_json})
+
+
+def _form(form_class, validate, **kwargs):
+    form = form_class(**kwargs)
+    if validate:
+        form.validate()
+    return form
+
+
+def _login(validate=False, failed=False):
+    form = _form(LoginForm, validate)
+    context = dict(form=form, errors=get_errors_from_wtform(form), next=None)
+    if failed:
+        context.update(
+            errors=govuk_errors({
+                "email_address": {"message": "Enter your email address", "input_name": "email_address"},
+                "password": {"message": "Enter your password", "input_name": "password"},
+            }),
+            error_summary_description_text=NO_ACCOUNT_MESSAGE,
+        )
+    return "auth/login.html", dict(context, are_new_frameworks_live=not validate, g_cloud_frameworks_live=True)
+
+
+def _request_password_reset(validate=False):
+    form = _form(EmailAddressForm, validate)
+    return "auth/request-password-reset.html", dict(form=form, errors=get_errors_from_wtform(form))
+
+
+def _reset_password(validate=False):
+    form = _form(PasswordResetForm, validate)
+    return "auth/reset-password.html", dict(
+        email_address='user@example.com', form=form, errors=get_errors_from_wtform(form), token='token',
+    )
+
+
+def _change_password(validate=False):
+    form = _form(PasswordChangeForm, validate)
+    return "auth/change-password.html", dict(form=form, errors=get_errors_from_wtform(form), dashboard_url='/buyers')
+
+
+def _create_user(validate=False):
+    form = _form(CreateUserForm, validate)
+    return "auth/create-user.html", dict(
+        email_address='user@example.com', form=form, errors=get_errors_from_wtform(form),
+        role='supplier', supplier_name='Benchmark Supplier', token='token',
+    )
+
+
+def _create_user_error(user=None):
+    return "auth/create-user-error.html", dict(
+        error=None, support_email_address='support@example.com', role='buyer',
+        token={'role': 'buyer'} if user else None, user=user,
+    )
+
+
+def _user_research_consent():
+    form = UserResearchOptInForm(user_research_opt_in=True)
+    return "notifications/user-research-consent.html", dict(
+        form=form, errors=get_errors_from_wtform(form), dashboard_url='/buyers',
+    )
+
+
+def _cookie_settings():
+    return "cookies/cookie_settings.html", {}
+
+
+# name, request path, submitted form data (for error states), logged in user, context
+CASES = (
+    ("login", "/user/login", None, None, _login),
+    ("login-invalid", "/user/login", {'email_address': 'not-an-email'}, None, partial(_login, validate=True)),
+    ("login-failed", "/user/login", {'email_address': 'user@example.com', 'password': 'x'}, None,
+     partial(_login, validate=True, failed=True)),
+    ("request-password-reset", "/user/reset-password", None, None, _request_password_reset),
+    ("request-password-reset-invalid", "/user/reset-password", {'email_address': ''}, None,
+     partial(_request_password_reset, validate=True)),
+    ("reset-password", "/user/reset-password/token", None, None, _reset_password),
+    ("reset-password-invalid", "/user/reset-password/token", {'password': 'short', 'confirm_password': 'x'}, None,
+     partial(_reset_password, validate=True)),
+    ("change-password", "/user/change-password", None, _user(), _change_password),
+    ("change-password-invalid", "/user/change-password", {'password': 'short'}, _user(),
+     partial(_change_password, validate=True)),
+    ("create-user", "/user/create/token", None, None, _create_user),
+    ("create-user-invalid", "/user/create/token", {'phone_number': 'abc', 'password': 'short'}, None,
+     partial(_create_user, validate=True)),
+    ("create-user-error-expired", "/user/create/token", None, None, _create_user_error),
+    ("create-user-error-locked", "/user/create/token", None, None,
+     partial(_create_user_error, user=_user(role='supplier', locked=True))),
+    ("user-research-consent", "/user/notifications/user-research", None, _user(), _user_research_consent),
+    ("cookie-settings", "/user/cookie-settings", None, None, _cookie_settings),
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=200, help="renders per measurement (default: %(default)s)")
+    parser.add_argument("--fragment-cache", action="store_true", help="cache template fragments, as in production")
+    parser.add_argument("--only", help="only render cases whose name contains this")
+    args = parser.parse_args()
+
+    os.environ.update(
+        WTF_CSRF_ENABLED="false",
+        DM_TEMPLATE_FRAGMENT_CACHE_SIZE="1000" if args.fragment_cache else "0",
+        DM_LOG_LEVEL="ERROR",
+    )
+
+    with mock.patch('dmutils.session.init_app'):
+        from app import create_app
+        app = create_app('development')
+
+    print(f"{'template':<34}{'renders/s':>12}{'ms/render':>12}{'peak KiB':>12}")
+    for name, path, data, user, build_context in CASES:
+        if args.only and args.only not in name:
+            continue
+
+        method = 'POST' if data is not None else 'GET'
+        with app.test_request_context(path, method=method, data=data):
+            if user:
+                login_user(user)
+            template, context = build_context()
+
+            # the first render loads and compiles the template and everything it imports
+            render_template(template, **context)
+            seconds = min(timeit.repeat(lambda: render_template(template, **context), number=args.number, repeat=3))
+
+            tracemalloc.start()
+            render_template(template, **context)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+        print(f"{name:<34}{args.number / seconds:>12.0f}{seconds / args.number * 1000:>12.2f}{peak / 1024:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
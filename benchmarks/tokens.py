@@ -0,0 +1,54 @@
+"""
+Compare the per-call cost of generating tokens with `dmutils.email.tokens`, which derives the key and builds a Fernet
+instance on every call, against the app's `TokenService`, which builds it once in `init_app`. (The app leaves
+decoding to `dmutils.email.tokens`, so there's nothing to compare there.)
+
+Usage:
+
+    python -m benchmarks.tokens [--number N]
+"""
+import argparse
+import timeit
+
+from flask import Flask
+
+from dmutils.email.tokens import generate_token
+
+from app.tokens import TokenService
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=20000, help="calls per measurement (default: %(default)s)")
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config.update(
+        SHARED_EMAIL_KEY="benchmark-key",
+        RESET_PASSWORD_TOKEN_NS="ResetPasswordSalt",
+    )
+    token_service = TokenService()
+    token_service.init_app(app)
+
+    key, namespace = app.config["SHARED_EMAIL_KEY"], app.config["RESET_PASSWORD_TOKEN_NS"]
+
+    cases = (
+        (
+            "generate",
+            lambda: generate_token({"user": 123}, key, namespace),
+            lambda: token_service.generate_token({"user": 123}, namespace),
+        ),
+    )
+
+    print(f"{'operation':<10}{'dmutils (us/call)':>20}{'TokenService (us/call)':>25}{'saving':>10}")
+    for name, dmutils_call, service_call in cases:
+        dmutils_time = min(timeit.repeat(dmutils_call, number=args.number, repeat=5)) / args.number
+        service_time = min(timeit.repeat(service_call, number=args.number, repeat=5)) / args.number
+        print(
+            f"{name:<10}{dmutils_time * 1e6:>20.2f}{service_time * 1e6:>25.2f}"
+            f"{(1 - service_time / dmutils_time):>10.0%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
 import os
-import jinja2
+import tempfile
 from dmutils.status import get_version_label
 from dmutils.asset_fingerprint import AssetFingerprinter
 
@@ -27,6 +27,18 @@ class Config(object):
     DM_DATA_API_URL = None
     DM_DATA_API_AUTH_TOKEN = None
     DM_NOTIFY_API_KEY = None
+    # can be pointed at a local stand-in (see benchmarks/notify_stub.py) to exercise emails without using Notify
+    DM_NOTIFY_API_BASE_URL = 'https://api.notifications.service.gov.uk'
+    # Queue Notify emails and deliver them from a background thread rather than during the request
+    DM_EMAIL_OUTBOX_ENABLED = False
+    DM_EMAIL_OUTBOX_MAX_ATTEMPTS = 5
+    DM_EMAIL_OUTBOX_RETRY_BACKOFF = 1  # seconds before the first retry, doubling for each one after that
+    DM_EMAIL_OUTBOX_DRAIN_TIMEOUT = 10  # seconds to spend sending queued emails when a worker exits
+    # SQLite database to keep queued emails in, so they survive a restart - they're only held in memory if unset
+    DM_EMAIL_OUTBOX_PATH = None
+    DM_EMAIL_OUTBOX_BATCH_SIZE = 20
+    DM_EMAIL_OUTBOX_POLL_INTERVAL = 1  # seconds between checks for emails queued by other workers
+    DM_EMAIL_OUTBOX_CLAIM_TIMEOUT = 300  # seconds before an email claimed by a worker that died is sent again
     DM_REDIS_SERVICE_NAME = None
 
     NOTIFY_TEMPLATES = {
@@ -43,6 +55,56 @@ class Config(object):
     RESET_PASSWORD_TOKEN_NS = 'ResetPasswordSalt'
     INVITE_EMAIL_TOKEN_NS = 'InviteEmailSalt'
 
+    # Valid invitation token payloads are cached per-worker (never beyond the token's own expiry)
+    DM_INVITATION_TOKEN_CACHE_TTL = 3600
+    DM_INVITATION_TOKEN_CACHE_SIZE = 1000
+    # Repeat password reset requests for the same email address are ignored (per-worker) for this many seconds
+    DM_RESET_PASSWORD_SUPPRESSION_WINDOW = 300
+    DM_RESET_PASSWORD_SUPPRESSION_SIZE = 10000
+    # Reset requests are padded to this percentile of recent real send times (in seconds), clamped to the min and max,
+    # so response times don't reveal whether an address has an account. A max of 0 turns padding off.
+    DM_RESET_PASSWORD_MIN_RESPONSE_TIME = 0.3
+    DM_RESET_PASSWORD_MAX_RESPONSE_TIME = 3
+    DM_RESET_PASSWORD_RESPONSE_TIME_PERCENTILE = 95
+    DM_RESET_PASSWORD_RESPONSE_TIME_SAMPLES = 200
+
+    # Rendered HTML of pages that are the same for every anonymous visitor is cached per-worker for this many seconds
+    DM_PAGE_CACHE_TTL = 300
+    DM_PAGE_CACHE_SIZE = 500
+    # Error pages (other than those with custom messages) are cached per-worker for this many seconds
+    DM_ERROR_PAGE_CACHE_TTL = 300
+    DM_ERROR_PAGE_CACHE_SIZE = 100
+    # Template fragments in `{% cache %}` tags (such as the page header and footer) are cached per-worker for up to
+    # this many seconds
+    DM_TEMPLATE_FRAGMENT_CACHE_TTL = 3600
+    DM_TEMPLATE_FRAGMENT_CACHE_SIZE = 1000
+
+    # Record render times of each template and imported macro (and log each request's slowest with the report on)
+    DM_TEMPLATE_PROFILING = False
+    DM_TEMPLATE_PROFILING_REPORT = False
+
+    # Directory to keep compiled templates in, shared by all workers (can be filled ahead of time with
+    # scripts/compile_templates.py --bytecode-cache)
+    DM_TEMPLATE_BYTECODE_CACHE_DIR = None
+    # Directory of templates precompiled to Python modules by scripts/compile_templates.py --modules (run when the wsgi
+    # image is built), used in place of the template sources
+    DM_COMPILED_TEMPLATES_DIR = None
+    # Directory to keep template source in once govuk-frontend-jinja has transformed it from Nunjucks into Jinja, so
+    # it needn't be done again after a restart (transformed source is always cached in memory)
+    DM_TEMPLATE_TRANSFORM_CACHE_DIR = None
+
+    # Fingerprints of the static assets, written by scripts/fingerprint_assets.py, so that workers needn't hash the
+    # assets themselves
+    DM_ASSET_MANIFEST_PATH = None
+    # The assets each template uses, written by scripts/compile_templates.py, for sending `Link: rel=preload` headers
+    # for the stylesheets and scripts each page uses - there are no preload headers if unset
+    DM_TEMPLATE_ASSETS_PATH = None
+
+    # Have the web server in front of the app send static files, rather than the app reading and sending them itself:
+    # 'x-sendfile', or 'x-accel-redirect' to redirect to app/static's internal location in nginx, at this prefix
+    DM_STATIC_OFFLOAD = None
+    DM_STATIC_OFFLOAD_PREFIX = '/_static/'
+
     STATIC_URL_PATH = '/user/static'
     ASSET_PATH = STATIC_URL_PATH + '/'
     BASE_TEMPLATE_DATA = {
@@ -69,8 +131,8 @@ class Config(object):
             os.path.join(govuk_frontend),
             os.path.join(digitalmarketplace_govuk_frontend, 'digitalmarketplace', 'templates'),
         ]
-        jinja_loader = jinja2.FileSystemLoader(template_folders)
-        app.jinja_loader = jinja_loader
+        from app.templating import IndexedFileSystemLoader
+        app.jinja_loader = IndexedFileSystemLoader(template_folders)
 
 
 class Test(Config):
@@ -86,6 +148,11 @@ class Test(Config):
     SHARED_EMAIL_KEY = "KEY"
     SECRET_KEY = "KEY2"
 
+    DM_RESET_PASSWORD_MAX_RESPONSE_TIME = 0
+    DM_PAGE_CACHE_SIZE = 0
+    DM_TEMPLATE_FRAGMENT_CACHE_SIZE = 0
+    DM_ERROR_PAGE_CACHE_SIZE = 0
+
 
 class Development(Config):
     DEBUG = True
@@ -99,12 +166,28 @@ class Development(Config):
     SECRET_KEY = "verySecretKey"
     SHARED_EMAIL_KEY = "very_secret"
 
+    DM_TEMPLATE_TRANSFORM_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'user-frontend-template-transforms')
+    # so that template changes show up without a restart
+    DM_PAGE_CACHE_SIZE = 0
+    DM_TEMPLATE_FRAGMENT_CACHE_SIZE = 0
+    DM_ERROR_PAGE_CACHE_SIZE = 0
+
 
 class SharedLive(Config):
     """Base config for deployed environments shared between GPaaS and AWS"""
     DEBUG = False
     DM_HTTP_PROTO = 'https'
 
+    DM_EMAIL_OUTBOX_ENABLED = True
+    # shared by the workers in a container, so that a worker being killed doesn't lose its emails - set
+    # DM_EMAIL_OUTBOX_PATH to somewhere on a persistent volume for them to survive the container being replaced too
+    DM_EMAIL_OUTBOX_PATH = '/tmp/email-outbox.sqlite3'
+    # only a fallback, for any template that wasn't compiled to a module - it's filled at runtime
+    DM_TEMPLATE_BYTECODE_CACHE_DIR = os.path.join(basedir, 'build', 'template-bytecode')
+    DM_COMPILED_TEMPLATES_DIR = os.path.join(basedir, 'build', 'compiled-templates')
+    DM_ASSET_MANIFEST_PATH = os.path.join(basedir, 'build', 'asset-manifest.json')
+    DM_TEMPLATE_ASSETS_PATH = os.path.join(basedir, 'build', 'template-assets.json')
+
     # use of invalid email addresses with live api keys annoys Notify
     DM_NOTIFY_REDIRECT_DOMAINS_TO_ADDRESS = {
         "example.com": "success@simulator.amazonses.com",
@@ -5,6 +5,8 @@ const sass = require('gulp-sass')(require('sass'))
 const filelog = require('gulp-filelog')
 const include = require('gulp-include')
 const path = require('path')
+const { Transform } = require('stream')
+const zlib = require('zlib')
 
 // Paths
 let environment
@@ -21,10 +23,13 @@ const jsSourceFile = path.join(assetsFolder, 'javascripts', 'application.js')
 const jsDistributionFolder = path.join(staticFolder, 'javascripts')
 const jsDistributionFile = 'application.js'
 
-// CSS paths
+// CSS paths (application-critical.scss builds the styles inlined into the auth pages)
 const cssSourceGlob = path.join(assetsFolder, 'scss', 'application*.scss')
 const cssDistributionFolder = path.join(staticFolder, 'stylesheets')
 
+// Assets to store gzip and brotli compressed copies of, so they needn't be compressed for each request
+const compressibleGlob = path.join(staticFolder, '**', '*.{css,js,svg}')
+
 // Configuration
 const sassOptions = {
   development: {
@@ -161,6 +166,41 @@ gulp.task(
   )
 )
 
+// Adds .gz and .br copies of every file passed through it
+function precompress () {
+  return new Transform({
+    objectMode: true,
+    transform (file, encoding, callback) {
+      const gzipped = file.clone({ contents: false })
+      gzipped.path = file.path + '.gz'
+      gzipped.contents = zlib.gzipSync(file.contents, { level: zlib.constants.Z_BEST_COMPRESSION })
+
+      const brotliCompressed = file.clone({ contents: false })
+      brotliCompressed.path = file.path + '.br'
+      brotliCompressed.contents = zlib.brotliCompressSync(file.contents, {
+        params: { [zlib.constants.BROTLI_PARAM_QUALITY]: zlib.constants.BROTLI_MAX_QUALITY }
+      })
+
+      this.push(gzipped)
+      this.push(brotliCompressed)
+      callback()
+    }
+  })
+}
+
+gulp.task('compress', function () {
+  const stream = gulp.src(compressibleGlob, { base: staticFolder })
+    .pipe(filelog('Precompressing static assets'))
+    .pipe(precompress())
+    .pipe(gulp.dest(staticFolder))
+
+  stream.on('end', function () {
+    console.log('🗜  Compressed copies of static assets saved as .gz and .br files in ' + staticFolder)
+  })
+
+  return stream
+})
+
 gulp.task('set_environment_to_development', function (cb) {
   environment = 'development'
   cb()
@@ -178,7 +218,7 @@ gulp.task('copy', gulp.parallel(
   'copy:govuk_frontend_assets:images'
 ))
 
-gulp.task('compile', gulp.series('copy', gulp.parallel('sass', 'js')))
+gulp.task('compile', gulp.series('copy', gulp.parallel('sass', 'js'), 'compress'))
 
 gulp.task('build:development', gulp.series(gulp.parallel('set_environment_to_development', 'clean'), 'compile'))
 
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""
+Compile every template the app can load, so that workers load compiled templates rather than parsing (and, for the
+govuk-frontend Nunjucks templates, transforming) and compiling them at runtime.
+
+With `--modules`, templates are written as importable Python modules for `DM_COMPILED_TEMPLATES_DIR` - this is run
+when the wsgi image is built (see docker-aws/Dockerfile.wsgi), as it needs the app and its dependencies. With
+`--bytecode-cache`, they are stored in a `DM_TEMPLATE_BYTECODE_CACHE_DIR` instead, for environments that don't use
+compiled modules; bytecode is specific to the Python version, so that must be run by the interpreter that will serve
+the app.
+
+With `--template-assets`, the assets each template uses are written to a file for `DM_TEMPLATE_ASSETS_PATH`, so that
+pages can have preload links without their templates being parsed at runtime.
+
+Usage:
+
+    scripts/compile_templates.py [--modules DIRECTORY] [--bytecode-cache DIRECTORY] [--template-assets FILE]
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from jinja2 import TemplateSyntaxError  # noqa: E402
+
+from app import create_app  # noqa: E402
+from app.assets import find_template_assets  # noqa: E402
+from app.templating import VersionedFileSystemBytecodeCache  # noqa: E402
+
+TEMPLATE_EXTENSIONS = ('.html', '.njk')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modules", help="directory to write templates compiled to Python modules to")
+    parser.add_argument("--bytecode-cache", help="directory to store compiled template bytecode in")
+    parser.add_argument("--template-assets", help="file to write the assets each template uses to")
+    args = parser.parse_args()
+    if not (args.modules or args.bytecode_cache or args.template_assets):
+        parser.error("one of --modules, --bytecode-cache or --template-assets is required")
+
+    app = create_app('development')
+
+    if args.modules:
+        compile_to_modules(app, args.modules)
+    if args.bytecode_cache:
+        compile_to_bytecode_cache(app, args.bytecode_cache)
+    if args.template_assets:
+        write_template_assets(app, args.template_assets)
+
+
+def _is_template(name):
+    return name.endswith(TEMPLATE_EXTENSIONS)
+
+
+def compile_to_modules(app, directory):
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+
+    failed = []
+    app.jinja_env.compile_templates(
+        directory,
+        filter_func=_is_template,
+        zip=None,
+        log_function=lambda message: message.startswith('Could not compile') and failed.append(message),
+    )
+    for message in failed:
+        print(message, file=sys.stderr)
+    print("Compiled {} templates into {}".format(len(os.listdir(directory)), directory), file=sys.stderr)
+
+
+def compile_to_bytecode_cache(app, directory):
+    os.makedirs(directory, exist_ok=True)
+    app.jinja_env.bytecode_cache = VersionedFileSystemBytecodeCache(directory)
+
+    compiled, failed = 0, []
+    for name in app.jinja_env.list_templates(filter_func=_is_template):
+        try:
+            app.jinja_env.get_template(name)
+            compiled += 1
+        except TemplateSyntaxError as e:
+            failed.append((name, e))
+
+    for name, error in failed:
+        print("Could not compile {}: {}".format(name, error), file=sys.stderr)
+    print("Compiled {} templates into {}".format(compiled, directory), file=sys.stderr)
+
+
+def write_template_assets(app, path):
+    parsed = {}
+    template_assets = {}
+    for name in app.jinja_env.list_templates(filter_func=_is_template):
+        try:
+            assets = find_template_assets(app.jinja_env, name, loader=app.jinja_loader, parsed=parsed)
+        except TemplateSyntaxError as e:
+            print("Could not find the assets of {}: {}".format(name, e), file=sys.stderr)
+            continue
+        if assets:
+            template_assets[name] = assets
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(template_assets, f, indent=2, sort_keys=True)
+    print("Found the assets of {} templates for {}".format(len(template_assets), path), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
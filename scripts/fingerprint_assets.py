@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+"""
+Write a manifest of the fingerprint of every static asset, for `DM_ASSET_MANIFEST_PATH`, so that workers needn't
+read and hash assets to build their URLs. This is run by the wsgi image build (`docker-aws/Dockerfile.wsgi`) once
+`scripts/build.sh` has built the assets.
+
+It only uses the standard library, so that it can be run before (or without) installing the app's dependencies.
+
+Usage:
+
+    scripts/fingerprint_assets.py [--static-folder DIRECTORY] [--output FILE]
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--static-folder", default="app/static", help="built assets (default: %(default)s)")
+    parser.add_argument("--output", default="build/asset-manifest.json", help="manifest file (default: %(default)s)")
+    args = parser.parse_args()
+
+    manifest = build_asset_manifest(args.static_folder)
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    print("Fingerprinted {} assets into {}".format(len(manifest), args.output), file=sys.stderr)
+
+
+def build_asset_manifest(static_folder):
+    """
+    Map the path (relative to `static_folder`) of every file in `static_folder` to its fingerprint - the same MD5
+    `AssetFingerprinter` would calculate from its contents.
+    """
+    manifest = {}
+    for dirpath, _, filenames in os.walk(static_folder):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            with open(path, 'rb') as f:
+                fingerprint = hashlib.md5(f.read()).hexdigest()
+            manifest[os.path.relpath(path, static_folder).replace(os.path.sep, '/')] = fingerprint
+    return dict(sorted(manifest.items()))
+
+
+if __name__ == "__main__":
+    main()
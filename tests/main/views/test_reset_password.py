@@ -1,3 +1,5 @@
+import sqlite3
+
 import mock
 import pytest
 from lxml import html, cssselect
@@ -8,6 +10,7 @@ from dmtestutils.comparisons import AnyStringMatching
 
 from ...helpers import BaseApplicationTest, MockMatcher
 
+from app import email_outbox, reset_password_timing
 from app.main.views import reset_password
 from app.main.forms.auth_forms import (
     EMAIL_EMPTY_ERROR_MESSAGE,
@@ -20,8 +23,6 @@ from app.main.forms.auth_forms import (
     PASSWORD_CHANGE_AUTH_ERROR_MESSAGE
 )
 
-PASSWORD_RESET_EMAIL_ERROR = "Try again later."  # Generic 500 error message content
-
 
 class TestSendResetPasswordEmail(BaseApplicationTest):
 
@@ -72,7 +73,7 @@ class TestSendResetPasswordEmail(BaseApplicationTest):
         "buyer",
         "supplier",
     ))
-    @mock.patch('app.main.views.reset_password.DMNotifyClient.send_email')
+    @mock.patch('app.notify.DMNotifyClient.send_email')
     def test_reset_password_request_redirects_to_same_page_and_shows_flash_message(self, send_email, user_role):
         self.data_api_client.get_user.return_value = self.user(
             123, "email@email.com", 1234, "Ahoy", name="Bob", role=user_role,
@@ -92,8 +93,8 @@ class TestSendResetPasswordEmail(BaseApplicationTest):
             template_name_or_id=self.app.config['NOTIFY_TEMPLATES']['reset_password']
         )]
 
-    @mock.patch('app.main.views.reset_password.DMNotifyClient.send_email')
-    def test_nonexistent_account_sends_email_to_sandbox_address(self, send_email):
+    @mock.patch('app.notify.DMNotifyClient.send_email')
+    def test_nonexistent_account_does_not_send_email(self, send_email):
         self.data_api_client.get_user.return_value = None
 
         with mock.patch('app.main.views.reset_password.current_app') as current_app_mock:
@@ -103,20 +104,31 @@ class TestSendResetPasswordEmail(BaseApplicationTest):
 
         assert res.status_code == 302
         self.assert_flashes("we'll send a link to reset the", expected_category="success")
-        assert send_email.call_args_list == [mock.call(
-            reset_password.NOTIFY_SANDBOX_ADDRESS,
-            reference="reset-password-nonexistent-user-{}".format(self.expected_email_hash),
-            template_name_or_id=current_app_mock.config['NOTIFY_TEMPLATES']['reset_password_inactive']
-        )]
+        assert send_email.call_args_list == []
         assert current_app_mock.logger.info.call_args_list == [mock.call(
-            '{code}: Sent password (non-)reset email for invalid user email_hash {email_hash}',
+            '{code}: Password reset requested for invalid user email_hash {email_hash}',
             extra={
                 'email_hash': self.expected_email_hash,
                 'code': 'login.reset-email.invalid-email'
             }
         )]
 
-    @mock.patch('app.main.views.reset_password.DMNotifyClient.send_email')
+    @mock.patch('app.timing.sleep')
+    @mock.patch('app.notify.DMNotifyClient.send_email')
+    def test_nonexistent_account_response_is_padded_to_real_send_time(self, send_email, sleep):
+        self.app.config.update(DM_RESET_PASSWORD_MIN_RESPONSE_TIME=0, DM_RESET_PASSWORD_MAX_RESPONSE_TIME=10)
+        reset_password_timing.init_app(self.app)
+        reset_password_timing.record(5)
+
+        self.data_api_client.get_user.return_value = None
+        res = self.client.post("/user/reset-password", data={'email_address': 'email@email.com'})
+
+        assert res.status_code == 302
+        assert send_email.call_args_list == []
+        assert sleep.call_count == 1
+        assert 4 < sleep.call_args[0][0] <= 5
+
+    @mock.patch('app.notify.DMNotifyClient.send_email')
     def test_should_strip_whitespace_surrounding_reset_password_email_address_field(self, send_email):
         self.client.post("/user/reset-password", data={
             'email_address': ' email@email.com'
@@ -129,9 +141,32 @@ class TestSendResetPasswordEmail(BaseApplicationTest):
             template_name_or_id=self.app.config['NOTIFY_TEMPLATES']['reset_password']
         )]
 
+    @mock.patch('app.notify.DMNotifyClient.send_email')
+    def test_repeat_requests_within_the_suppression_window_are_ignored(self, send_email):
+        for email_address in ('email@email.com', 'email@email.com', 'other@email.com'):
+            res = self.client.post("/user/reset-password", data={'email_address': email_address})
+
+            assert res.status_code == 302
+            assert res.location == 'http://localhost/user/reset-password'
+            self.assert_flashes("we'll send a link to reset the", expected_category="success")
+
+        assert self.data_api_client.get_user.call_args_list == [
+            mock.call(email_address='email@email.com'),
+            mock.call(email_address='other@email.com'),
+        ]
+        assert send_email.call_count == 2
+
+    @mock.patch('app.notify.DMNotifyClient.send_email')
+    def test_failed_requests_are_not_suppressed(self, send_email):
+        send_email.side_effect = [EmailError(Exception('Notify API is down')), None]
+
+        assert self.client.post("/user/reset-password", data={'email_address': 'email@email.com'}).status_code == 302
+        assert self.client.post("/user/reset-password", data={'email_address': 'email@email.com'}).status_code == 302
+        assert send_email.call_count == 2
+
     @mock.patch('app.main.helpers.logging_helpers.current_app')
-    @mock.patch('app.main.views.reset_password.DMNotifyClient.send_email')
-    def test_should_be_an_error_if_send_email_fails_for_real_user(self, send_email, current_app):
+    @mock.patch('app.notify.DMNotifyClient.send_email')
+    def test_send_email_failure_is_logged_but_not_revealed_for_real_user(self, send_email, current_app):
         send_email.side_effect = EmailError(Exception('Notify API is down'))
 
         res = self.client.post(
@@ -139,8 +174,8 @@ class TestSendResetPasswordEmail(BaseApplicationTest):
             data={'email_address': 'email@email.com'}
         )
 
-        assert res.status_code == 503
-        assert PASSWORD_RESET_EMAIL_ERROR in res.get_data(as_text=True)
+        assert res.status_code == 302
+        self.assert_flashes("we'll send a link to reset the", expected_category="success")
 
         assert current_app.logger.error.call_args_list == [mock.call(
             '{code}: {email_type} email for email_hash {email_hash} failed to send. Error: {error}',
@@ -152,31 +187,48 @@ class TestSendResetPasswordEmail(BaseApplicationTest):
             }
         )]
 
-    @mock.patch('app.main.helpers.logging_helpers.current_app')
-    @mock.patch('app.main.views.reset_password.DMNotifyClient.send_email')
-    def test_should_be_an_error_if_send_email_fails_for_nonexistent_user(self, send_email, current_app):
-        send_email.side_effect = EmailError(Exception('Notify API is down'))
-        self.data_api_client.get_user.return_value = None
+    @mock.patch('app.outbox.MemoryOutboxStore.add')
+    def test_outbox_failure_is_not_revealed(self, add):
+        add.side_effect = sqlite3.OperationalError("database is locked")
+        self.app.config.update(DM_EMAIL_OUTBOX_ENABLED=True)
+        email_outbox.init_app(self.app)
 
-        res = self.client.post(
-            '/user/reset-password',
-            data={'email_address': 'email@email.com'}
-        )
+        try:
+            res = self.client.post(
+                '/user/reset-password',
+                data={'email_address': 'email@email.com'}
+            )
+        finally:
+            email_outbox.shutdown()
 
-        assert res.status_code == 503
-        assert PASSWORD_RESET_EMAIL_ERROR in res.get_data(as_text=True)
+        assert res.status_code == 302
+        self.assert_flashes("we'll send a link to reset the", expected_category="success")
+        assert add.call_count == 1
 
-        assert current_app.logger.error.call_args_list == [mock.call(
-            '{code}: {email_type} email for email_hash {email_hash} failed to send. Error: {error}',
-            extra={
-                'email_hash': self.expected_email_hash,
-                'error': 'Notify API is down',
-                'code': 'login.reset-email-nonexistent.notify-error',
-                'email_type': "Password reset (non-existent user)"
-            }
+    @mock.patch('app.notify.DMNotifyClient.send_email')
+    def test_send_email_failure_does_not_affect_response_when_outbox_is_enabled(self, send_email):
+        send_email.side_effect = EmailError(Exception('Notify API is down'))
+        self.app.config.update(DM_EMAIL_OUTBOX_ENABLED=True, DM_EMAIL_OUTBOX_MAX_ATTEMPTS=1)
+        email_outbox.init_app(self.app)
+
+        try:
+            res = self.client.post(
+                '/user/reset-password',
+                data={'email_address': 'email@email.com'}
+            )
+        finally:
+            email_outbox.shutdown()
+
+        assert res.status_code == 302
+        self.assert_flashes("we'll send a link to reset the", expected_category="success")
+        assert send_email.call_args_list == [mock.call(
+            'email@email.com',
+            personalisation={'url': AnyStringMatching(r"http://localhost/user/reset-password/*")},
+            reference="reset-password-{}".format(self.expected_email_hash),
+            template_name_or_id=self.app.config['NOTIFY_TEMPLATES']['reset_password']
         )]
 
-    @mock.patch('app.main.views.reset_password.DMNotifyClient.send_email', autospec=True)
+    @mock.patch('app.notify.DMNotifyClient.send_email', autospec=True)
     def test_inactive_user_attempts_password_reset(self, send_email):
         self.data_api_client.get_user.return_value = self.user(
             123, "email@email.com", 1234, 'email', 'Name', active=False,
@@ -197,8 +249,8 @@ class TestSendResetPasswordEmail(BaseApplicationTest):
         )]
 
     @mock.patch('app.main.helpers.logging_helpers.current_app')
-    @mock.patch('app.main.views.reset_password.DMNotifyClient.send_email', autospec=True)
-    def test_should_be_an_error_if_send_email_fails_for_inactive_user(self, send_email, current_app):
+    @mock.patch('app.notify.DMNotifyClient.send_email', autospec=True)
+    def test_send_email_failure_is_logged_but_not_revealed_for_inactive_user(self, send_email, current_app):
         send_email.side_effect = EmailError(Exception('Notify API is down'))
         self.data_api_client.get_user.return_value = self.user(
             123, "email@email.com", 1234, 'email', 'Name', active=False,
@@ -208,8 +260,8 @@ class TestSendResetPasswordEmail(BaseApplicationTest):
             data={'email_address': 'email@email.com'}
         )
 
-        assert res.status_code == 503
-        assert PASSWORD_RESET_EMAIL_ERROR in res.get_data(as_text=True)
+        assert res.status_code == 302
+        self.assert_flashes("we'll send a link to reset the", expected_category="success")
 
         assert current_app.logger.error.call_args_list == [mock.call(
             '{code}: {email_type} email for email_hash {email_hash} failed to send. Error: {error}',
@@ -221,7 +273,7 @@ class TestSendResetPasswordEmail(BaseApplicationTest):
             }
         )]
 
-    @mock.patch("app.main.views.reset_password.DMNotifyClient.send_email", autospec=True)
+    @mock.patch("app.notify.DMNotifyClient.send_email", autospec=True)
     def test_admin_manager_does_not_get_reset_email(self, send_email):
         self.data_api_client.get_user.return_value = self.user(
             123, "email@email.com", name="Eve", role="admin-manager",
@@ -438,6 +490,26 @@ class TestResetPassword(BaseApplicationTest):
         assert reset_password.EXPIRED_PASSWORD_RESET_TOKEN_MESSAGE in error_elements[0].text_content()
         assert self.data_api_client.update_user_password.called is False
 
+    def test_token_is_checked_again_after_password_has_been_updated(self):
+        token = generate_token(
+            self._user,
+            self.app.config['SHARED_EMAIL_KEY'],
+            self.app.config['RESET_PASSWORD_TOKEN_NS'])
+        url = '/user/reset-password/{}'.format(token)
+
+        self.client.post(url, data={
+            'password': 'password12345',
+            'confirm_password': 'password12345'
+        })
+        self.data_api_client.get_user.return_value = self.user(
+            123, "email@email.com", 1234, 'email', 'Name', is_token_valid=False
+        )
+        res = self.client.get(url)
+
+        assert res.status_code == 302
+        assert res.location == 'http://localhost/user/reset-password'
+        assert self.data_api_client.get_user.call_args_list == [mock.call(123), mock.call(123)]
+
 
 class TestChangePassword(BaseApplicationTest):
 
@@ -545,7 +617,7 @@ class TestChangePassword(BaseApplicationTest):
             "digitalmarketplace",
         ),
     )
-    @mock.patch('app.main.views.reset_password.DMNotifyClient.send_email', autospec=True)
+    @mock.patch('app.notify.DMNotifyClient.send_email', autospec=True)
     def test_user_can_change_password(self, send_email, user_role, redirect_url, user_email, old_password):
         if user_role == 'buyer':
             self.login_as_buyer()
@@ -684,7 +756,7 @@ class TestChangePassword(BaseApplicationTest):
         )
 
     @mock.patch('app.main.helpers.logging_helpers.current_app')
-    @mock.patch('app.main.views.reset_password.DMNotifyClient.send_email')
+    @mock.patch('app.notify.DMNotifyClient.send_email')
     def test_should_log_an_error_and_redirect_if_change_password_email_sending_fails(self, send_email, current_app):
         self.login_as_supplier()
         send_email.side_effect = EmailError(Exception('Notify API is down'))
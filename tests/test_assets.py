@@ -0,0 +1,376 @@
+import gzip
+import json
+
+import jinja2
+import mock
+import pytest
+from dmutils.asset_fingerprint import AssetFingerprinter
+from flask import jsonify, redirect, render_template, request
+from werkzeug.exceptions import NotFound
+
+from app import asset_preloader, inline_assets
+from app.assets import (
+    ManifestAssetFingerprinter,
+    find_template_assets,
+    init_asset_fingerprinter,
+    init_static_view,
+    send_static_file,
+)
+from config import Config
+from scripts.fingerprint_assets import build_asset_manifest
+from .helpers import BaseApplicationTest
+
+
+def test_manifest_fingerprints_match_asset_fingerprinter(tmpdir):
+    tmpdir.join('stylesheets', 'application.css').write('body { color: red; }', ensure=True)
+    tmpdir.join('javascripts', 'application.js').write_text('var a = "é";', encoding='utf-8', ensure=True)
+    fingerprinter = AssetFingerprinter()
+
+    assert build_asset_manifest(str(tmpdir)) == {
+        name: fingerprinter.get_asset_fingerprint(str(tmpdir.join(name)))
+        for name in ('javascripts/application.js', 'stylesheets/application.css')
+    }
+
+
+class TestManifestAssetFingerprinter(object):
+
+    def test_urls_use_fingerprints_from_manifest_without_reading_assets(self):
+        fingerprinter = ManifestAssetFingerprinter({'application.css': 'abc123'}, asset_root='/user/static/')
+
+        with mock.patch.object(fingerprinter, 'get_asset_file_contents', side_effect=AssertionError("read asset")):
+            assert fingerprinter.get_url('application.css') == '/user/static/application.css?abc123'
+
+    def test_assets_missing_from_manifest_are_fingerprinted_at_runtime(self, tmpdir):
+        tmpdir.join('new.css').write('body {}')
+        filesystem_path = str(tmpdir) + '/'
+        fingerprinter = ManifestAssetFingerprinter({}, filesystem_path=filesystem_path)
+
+        expected = AssetFingerprinter(filesystem_path=filesystem_path).get_url('new.css')
+        assert fingerprinter.get_url('new.css') == expected
+
+
+class TestInitAssetFingerprinter(BaseApplicationTest):
+
+    def test_manifest_fingerprinter_is_installed_when_configured(self, tmpdir):
+        tmpdir.join('manifest.json').write(json.dumps({'stylesheets/application.css': 'abc123'}))
+        self.app.config['DM_ASSET_MANIFEST_PATH'] = str(tmpdir.join('manifest.json'))
+        init_asset_fingerprinter(self.app)
+
+        fingerprinter = self.app.config['BASE_TEMPLATE_DATA']['asset_fingerprinter']
+        assert fingerprinter.get_url('stylesheets/application.css') == (
+            '/user/static/stylesheets/application.css?abc123'
+        )
+        assert not isinstance(Config.BASE_TEMPLATE_DATA['asset_fingerprinter'], ManifestAssetFingerprinter)
+
+    def test_missing_manifest_is_ignored(self, tmpdir):
+        self.app.config['DM_ASSET_MANIFEST_PATH'] = str(tmpdir.join('missing.json'))
+        init_asset_fingerprinter(self.app)
+
+        assert self.app.config['BASE_TEMPLATE_DATA'] is Config.BASE_TEMPLATE_DATA
+
+
+class TestPrecompressedStatic(BaseApplicationTest):
+
+    def setup_method(self, method):
+        super().setup_method(method)
+        self.static_folder = self.app.static_folder
+
+    def teardown_method(self, method):
+        self.app.static_folder = self.static_folder
+        super().teardown_method(method)
+
+    def _static_folder(self, tmpdir, *encodings):
+        css = b'body { color: red; }'
+        tmpdir.join('application.css').write_binary(css)
+        if 'gzip' in encodings:
+            tmpdir.join('application.css.gz').write_binary(gzip.compress(css))
+        if 'br' in encodings:
+            tmpdir.join('application.css.br').write_binary(b'brotli')
+        self.app.static_folder = str(tmpdir)
+
+    def test_gzipped_copy_is_sent_to_clients_accepting_gzip(self, tmpdir):
+        self._static_folder(tmpdir, 'gzip')
+        response = self.client.get('/user/static/application.css', headers={'Accept-Encoding': 'gzip, deflate'})
+
+        assert response.status_code == 200
+        assert response.content_encoding == 'gzip'
+        assert response.mimetype == 'text/css'
+        assert gzip.decompress(response.get_data()) == b'body { color: red; }'
+        assert 'Accept-Encoding' in response.vary
+
+    def test_brotli_is_preferred_over_gzip(self, tmpdir):
+        self._static_folder(tmpdir, 'gzip', 'br')
+        response = self.client.get('/user/static/application.css', headers={'Accept-Encoding': 'gzip, br'})
+
+        assert response.content_encoding == 'br'
+        assert response.get_data() == b'brotli'
+
+    def test_uncompressed_file_is_sent_to_clients_not_accepting_compression(self, tmpdir):
+        self._static_folder(tmpdir, 'gzip', 'br')
+        response = self.client.get('/user/static/application.css', headers={'Accept-Encoding': 'identity'})
+
+        assert response.content_encoding is None
+        assert response.get_data() == b'body { color: red; }'
+        assert 'Accept-Encoding' in response.vary
+
+    def test_files_without_compressed_copies_do_not_vary(self, tmpdir):
+        self._static_folder(tmpdir)
+        response = self.client.get('/user/static/application.css', headers={'Accept-Encoding': 'gzip, br'})
+
+        assert response.content_encoding is None
+        assert 'Accept-Encoding' not in response.vary
+
+    def _fingerprint(self, tmpdir, *names):
+        manifest = {name: build_asset_manifest(str(tmpdir))[name] for name in names}
+        self.app.config['BASE_TEMPLATE_DATA'] = dict(
+            self.app.config['BASE_TEMPLATE_DATA'],
+            asset_fingerprinter=ManifestAssetFingerprinter(manifest, asset_root='/user/static/'),
+        )
+        return manifest
+
+    def test_current_fingerprinted_url_is_cached_immutably(self, tmpdir):
+        self._static_folder(tmpdir)
+        manifest = self._fingerprint(tmpdir, 'application.css')
+        response = self.client.get('/user/static/application.css?{}'.format(manifest['application.css']))
+
+        assert response.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
+
+    def test_stale_fingerprinted_url_is_not_cached_immutably(self, tmpdir):
+        self._static_folder(tmpdir)
+        self._fingerprint(tmpdir, 'application.css')
+        response = self.client.get('/user/static/application.css?0123456789abcdef0123456789abcdef')
+
+        assert 'immutable' not in response.headers['Cache-Control']
+
+    def test_etags_come_from_the_manifest_and_differ_by_encoding(self, tmpdir):
+        self._static_folder(tmpdir, 'gzip')
+        manifest = self._fingerprint(tmpdir, 'application.css', 'application.css.gz')
+
+        response = self.client.get('/user/static/application.css', headers={'If-None-Match': 'x'})
+        gzipped = self.client.get('/user/static/application.css', headers={'Accept-Encoding': 'gzip'})
+
+        assert response.status_code == 200
+        assert response.get_etag() == (manifest['application.css'], False)
+        assert gzipped.get_etag() == (manifest['application.css.gz'], False)
+
+        revalidated = self.client.get(
+            '/user/static/application.css', headers={'If-None-Match': '"{}"'.format(manifest['application.css'])}
+        )
+        assert revalidated.status_code == 304
+
+    def test_assets_are_only_immutable_if_fingerprinted_in_the_manifest(self, tmpdir):
+        self._static_folder(tmpdir)
+        fingerprint = build_asset_manifest(str(tmpdir))['application.css']
+
+        with mock.patch.object(AssetFingerprinter, 'get_asset_fingerprint') as get_asset_fingerprint:
+            response = self.client.get('/user/static/application.css?{}'.format(fingerprint))
+
+        assert 'immutable' not in response.headers['Cache-Control']
+        assert get_asset_fingerprint.called is False
+
+    def test_paths_outside_the_static_folder_are_not_read(self, tmpdir):
+        self._static_folder(tmpdir.mkdir('static'))
+        tmpdir.join('secret.txt').write('secret')
+
+        with mock.patch.object(AssetFingerprinter, 'get_asset_file_contents') as get_asset_file_contents:
+            with self.app.test_request_context('/user/static/../secret.txt?x'), pytest.raises(NotFound):
+                send_static_file('../secret.txt')
+
+        assert get_asset_file_contents.called is False
+
+    def test_assets_missing_from_manifest_still_have_strong_etags(self, tmpdir):
+        self._static_folder(tmpdir)
+        self._fingerprint(tmpdir)
+        etag, weak = self.client.get('/user/static/application.css').get_etag()
+
+        assert etag and not weak
+        revalidated = self.client.get('/user/static/application.css', headers={'If-None-Match': '"{}"'.format(etag)})
+        assert revalidated.status_code == 304
+
+    def test_files_can_be_offloaded_with_x_sendfile(self, tmpdir):
+        self._static_folder(tmpdir)
+        self.app.config['DM_STATIC_OFFLOAD'] = 'x-sendfile'
+        init_static_view(self.app)
+        response = self.client.get('/user/static/application.css')
+
+        assert response.headers['X-Sendfile'] == str(tmpdir.join('application.css'))
+        assert response.get_data() == b''
+
+    def test_files_can_be_offloaded_with_x_accel_redirect(self, tmpdir):
+        self._static_folder(tmpdir, 'gzip')
+        self.app.config['DM_STATIC_OFFLOAD'] = 'x-accel-redirect'
+        init_static_view(self.app)
+        response = self.client.get('/user/static/application.css', headers={'Accept-Encoding': 'gzip'})
+
+        assert response.headers['X-Accel-Redirect'] == '/_static/application.css.gz'
+        assert response.content_encoding == 'gzip'
+        assert 'X-Sendfile' not in response.headers
+        assert response.content_length == 0
+        assert response.get_data() == b''
+
+    def test_not_modified_responses_are_not_offloaded(self, tmpdir):
+        self._static_folder(tmpdir)
+        manifest = self._fingerprint(tmpdir, 'application.css')
+        self.app.config['DM_STATIC_OFFLOAD'] = 'x-accel-redirect'
+        init_static_view(self.app)
+        response = self.client.get(
+            '/user/static/application.css', headers={'If-None-Match': '"{}"'.format(manifest['application.css'])}
+        )
+
+        assert response.status_code == 304
+        assert 'X-Accel-Redirect' not in response.headers
+
+    def test_unknown_offload_mode_is_ignored(self, tmpdir):
+        self._static_folder(tmpdir)
+        self.app.config['DM_STATIC_OFFLOAD'] = 'carrier-pigeon'
+        with mock.patch.object(self.app.logger, 'warning') as warning:
+            init_static_view(self.app)
+
+        assert warning.called
+        assert self.client.get('/user/static/application.css').get_data() == b'body { color: red; }'
+
+    @mock.patch('app.error_pages.render_error_page', return_value=('Not found', 404))
+    def test_missing_files_are_not_found(self, render_error_page, tmpdir):
+        self._static_folder(tmpdir, 'gzip')
+        assert self.client.get('/user/static/missing.css').status_code == 404
+
+
+PRELOAD_TEMPLATES = {
+    'base.html': (
+        "<link href=\"{{ asset_fingerprinter.get_url('stylesheets/application.css') }}\">"
+        "{% block body %}{% endblock %}"
+        "{% include 'missing.html' ignore missing %}"
+        "<script src=\"{{ asset_fingerprinter.get_url('javascripts/application.js') }}\"></script>"
+    ),
+    'page.html': (
+        "{% extends 'base.html' %}{% block body %}{% include 'logo.html' %}{% include some_template %}{% endblock %}"
+    ),
+    'logo.html': "<img src=\"{{ asset_fingerprinter.get_url('images/logo.png') }}\">",
+}
+
+
+def test_find_template_assets_follows_template_references():
+    environment = jinja2.Environment(loader=jinja2.DictLoader(PRELOAD_TEMPLATES))
+
+    assert find_template_assets(environment, 'page.html') == [
+        'stylesheets/application.css', 'javascripts/application.js', 'images/logo.png',
+    ]
+
+
+def test_find_template_assets_only_parses_each_template_once():
+    environment = jinja2.Environment(loader=jinja2.DictLoader(PRELOAD_TEMPLATES))
+    parsed = {}
+
+    with mock.patch.object(environment, 'parse', wraps=environment.parse) as parse:
+        find_template_assets(environment, 'page.html', parsed=parsed)
+        assert find_template_assets(environment, 'base.html', parsed=parsed) == [
+            'stylesheets/application.css', 'javascripts/application.js',
+        ]
+
+    assert sorted(call[0][1] for call in parse.call_args_list) == ['base.html', 'logo.html', 'page.html']
+
+
+class TestAssetPreloader(BaseApplicationTest):
+
+    def setup_method(self, method):
+        super().setup_method(method)
+        self.app.jinja_loader = jinja2.DictLoader(PRELOAD_TEMPLATES)
+        self.app.config['BASE_TEMPLATE_DATA'] = dict(
+            self.app.config['BASE_TEMPLATE_DATA'],
+            asset_fingerprinter=ManifestAssetFingerprinter(
+                {'stylesheets/application.css': 'abc', 'javascripts/application.js': 'def', 'images/logo.png': 'ghi'},
+                asset_root='/user/static/',
+            ),
+        )
+
+        self.rendered = False
+
+        @self.app.route('/preload')
+        def page():
+            if 'redirect' in request.args:
+                return redirect('/elsewhere')
+            if self.rendered:
+                return 'cached page'
+            self.rendered = True
+            return render_template('page.html', some_template='logo.html')
+
+        @self.app.route('/preload.json')
+        def data():
+            render_template('page.html', some_template='logo.html')
+            return jsonify({})
+
+    def _init_preloader(self, tmpdir):
+        environment = jinja2.Environment(loader=jinja2.DictLoader(PRELOAD_TEMPLATES))
+        tmpdir.join('template-assets.json').write(json.dumps({
+            name: find_template_assets(environment, name) for name in PRELOAD_TEMPLATES
+        }))
+        self.app.config['DM_TEMPLATE_ASSETS_PATH'] = str(tmpdir.join('template-assets.json'))
+        asset_preloader.init_app(self.app)
+
+    def test_pages_preload_their_stylesheets_and_scripts(self, tmpdir):
+        self._init_preloader(tmpdir)
+        expected = (
+            '</user/static/stylesheets/application.css?abc>; rel=preload; as=style, '
+            '</user/static/javascripts/application.js?def>; rel=preload; as=script'
+        )
+
+        # templates are never parsed for their assets while serving requests
+        with mock.patch('app.assets._parse_template_assets', side_effect=AssertionError("parsed")):
+            assert self.client.get('/preload').headers['Link'] == expected
+            # the page isn't rendered again, but the route's assets are remembered
+            assert self.client.get('/preload').headers['Link'] == expected
+
+    def test_other_responses_are_not_given_preload_links(self, tmpdir):
+        self._init_preloader(tmpdir)
+        assert 'Link' not in self.client.get('/preload.json').headers
+
+    def test_redirects_are_not_given_preload_links(self, tmpdir):
+        self._init_preloader(tmpdir)
+        assert 'Link' in self.client.get('/preload').headers
+
+        response = self.client.get('/preload?redirect')
+        assert response.status_code == 302
+        assert response.mimetype == 'text/html'
+        assert 'Link' not in response.headers
+
+    def test_missing_template_assets_are_ignored(self, tmpdir):
+        self.app.config['DM_TEMPLATE_ASSETS_PATH'] = str(tmpdir.join('missing.json'))
+        with mock.patch.object(self.app.logger, 'warning') as warning:
+            asset_preloader.init_app(self.app)
+
+        assert warning.called
+        assert 'Link' not in self.client.get('/preload').headers
+
+
+class TestInlineAssets(BaseApplicationTest):
+
+    def setup_method(self, method):
+        super().setup_method(method)
+        self.static_folder = self.app.static_folder
+
+    def teardown_method(self, method):
+        self.app.static_folder = self.static_folder
+        super().teardown_method(method)
+
+    def _render(self, source):
+        with self.app.test_request_context('/'):
+            return self.app.jinja_env.from_string(source).render()
+
+    def test_assets_are_inlined_and_kept_in_memory(self, tmpdir):
+        tmpdir.join('stylesheets', 'critical.css').write('a::after { content: "</style>" }', ensure=True)
+        self.app.static_folder = str(tmpdir)
+        self.app.debug = False
+        inline_assets.init_app(self.app)
+
+        source = "<style>{{ inline_asset('stylesheets/critical.css') }}</style>"
+        assert self._render(source) == '<style>a::after { content: "<\\/style>" }</style>'
+
+        tmpdir.join('stylesheets', 'critical.css').remove()
+        assert self._render(source) == '<style>a::after { content: "<\\/style>" }</style>'
+
+    def test_missing_assets_are_inlined_as_nothing(self, tmpdir):
+        self.app.static_folder = str(tmpdir)
+        inline_assets.init_app(self.app)
+
+        assert self._render("{{ inline_asset('stylesheets/critical.css') or 'link' }}") == 'link'
+        assert self._render("{{ inline_asset('../secrets.txt') or 'link' }}") == 'link'
@@ -0,0 +1,65 @@
+import mock
+
+from app.caching import ExpiringLRUCache
+
+
+class TestExpiringLRUCache(object):
+
+    def test_get_returns_stored_value(self):
+        cache = ExpiringLRUCache(maxsize=2, ttl=10)
+        cache.set('a', 1)
+
+        assert cache.get('a') == 1
+        assert cache.get('b') is None
+        assert cache.get('b', 'default') == 'default'
+
+    @mock.patch('app.caching.monotonic')
+    def test_entries_expire_after_ttl(self, monotonic):
+        monotonic.return_value = 100
+        cache = ExpiringLRUCache(maxsize=2, ttl=10)
+        cache.set('a', 1)
+        cache.set('b', 2, ttl=20)
+
+        monotonic.return_value = 110
+        assert cache.get('a') is None
+        assert cache.get('b') == 2
+        assert len(cache) == 1
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = ExpiringLRUCache(maxsize=2, ttl=10)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        assert cache.get('a') == 1
+        assert cache.get('b') is None
+        assert cache.get('c') == 3
+
+    def test_zero_maxsize_disables_cache(self):
+        cache = ExpiringLRUCache(maxsize=0, ttl=10)
+        cache.set('a', 1)
+
+        assert cache.get('a') is None
+
+    def test_pop(self):
+        cache = ExpiringLRUCache(maxsize=3, ttl=10)
+        cache.set('a', 1)
+        cache.set('b', 2)
+
+        assert cache.pop('a') == 1
+        assert cache.pop('a') is None
+        assert cache.get('b') == 2
+
+    @mock.patch('app.caching.monotonic')
+    def test_add_only_stores_missing_or_expired_keys(self, monotonic):
+        monotonic.return_value = 100
+        cache = ExpiringLRUCache(maxsize=2, ttl=10)
+
+        assert cache.add('a', 1) is True
+        assert cache.add('a', 2) is False
+        assert cache.get('a') == 1
+
+        monotonic.return_value = 110
+        assert cache.add('a', 3) is True
+        assert cache.get('a') == 3
@@ -0,0 +1,65 @@
+import mock
+import pytest
+from dmapiclient import HTTPError
+from werkzeug.exceptions import NotFound
+
+from app import error_page_cache
+from app.error_pages import _error_page_status_code
+from .helpers import BaseApplicationTest
+
+
+class TestErrorPageCache(BaseApplicationTest):
+
+    def setup_method(self, method):
+        super().setup_method(method)
+        self.app.config['DM_ERROR_PAGE_CACHE_SIZE'] = 10
+        error_page_cache.init_app(self.app)
+
+        self.render_error_page_patch = mock.patch(
+            'app.error_pages.render_error_page',
+            side_effect=lambda e=None, status_code=None, error_message=None: (
+                'Error {}'.format(status_code), status_code
+            ),
+        )
+        self.render_error_page = self.render_error_page_patch.start()
+
+    def teardown_method(self, method):
+        self.render_error_page_patch.stop()
+        super().teardown_method(method)
+
+    def test_error_pages_are_rendered_once_per_path(self):
+        responses = [self.client.get(path) for path in ('/user/missing', '/user/missing', '/user/also-missing')]
+
+        assert [response.status_code for response in responses] == [404, 404, 404]
+        assert responses[1].get_data(as_text=True) == 'Error 404'
+        assert self.render_error_page.call_count == 2
+
+    @mock.patch('app.main.views.auth.data_api_client', autospec=True)
+    def test_api_error_pages_are_cached_and_still_logged(self, data_api_client):
+        data_api_client.find_frameworks.side_effect = HTTPError(mock.Mock(status_code=503))
+
+        with mock.patch.object(self.app.logger, 'warning') as warning:
+            assert self.client.get('/user/login').status_code == 503
+            assert self.client.get('/user/login').status_code == 503
+
+        assert self.render_error_page.call_count == 1
+        assert warning.call_args[1]['extra']['status_code'] == 503
+
+    def test_pages_with_custom_messages_are_not_cached(self):
+        with self.app.test_request_context('/user/missing'):
+            error_page_cache.render_error_page(status_code=400, error_message="Cookies are required")
+            error_page_cache.render_error_page(status_code=400, error_message="Cookies are required")
+
+        assert self.render_error_page.call_count == 2
+
+
+@pytest.mark.parametrize('e, status_code, expected', (
+    (None, None, 500),
+    (None, 404, 404),
+    (None, 418, 500),
+    (NotFound(), None, 404),
+    (HTTPError(mock.Mock(status_code=503)), None, 503),
+    (Exception(), None, 500),
+))
+def test_error_page_status_code_matches_dmutils(e, status_code, expected):
+    assert _error_page_status_code(e, status_code) == expected
@@ -0,0 +1,77 @@
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from threading import Thread
+
+import mock
+
+from app import notify_client
+from app.notify import NOTIFY_CONNECTIONS_OPENED_TOTAL, NOTIFY_REQUESTS_TOTAL, PooledNotificationsAPIClient
+from .helpers import BaseApplicationTest
+
+
+class _NotifyHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        body = b'{"id": "notification-id"}'
+        self.send_response(201)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestNotifyClient(BaseApplicationTest):
+
+    def test_client_is_shared_between_sends(self):
+        with self.app.app_context():
+            assert notify_client.client is notify_client.client
+
+    def test_client_uses_configured_base_url(self):
+        self.app.config['DM_NOTIFY_API_BASE_URL'] = 'http://localhost:6011'
+        notify_client.init_app(self.app)
+
+        with self.app.app_context():
+            assert notify_client.client.client.base_url == 'http://localhost:6011'
+
+    def test_client_is_rebuilt_after_fork(self):
+        with self.app.app_context():
+            client = notify_client.client
+            with mock.patch('app.notify.os.getpid', return_value=-1):
+                assert notify_client.client is not client
+
+    def test_client_is_rebuilt_for_a_new_app(self):
+        with self.app.app_context():
+            client = notify_client.client
+        notify_client.init_app(self.app)
+
+        with self.app.app_context():
+            assert notify_client.client is not client
+
+
+class TestPooledNotificationsAPIClient(object):
+
+    def setup_method(self, method):
+        self.server = HTTPServer(('127.0.0.1', 0), _NotifyHandler)
+        Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def teardown_method(self, method):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connections_are_reused(self):
+        client = PooledNotificationsAPIClient(
+            "not_a_real_key-00000000-fake-uuid-0000-000000000000",
+            base_url='http://127.0.0.1:{}'.format(self.server.server_port),
+        )
+        requests_made = NOTIFY_REQUESTS_TOTAL._value.get()
+        connections_opened = NOTIFY_CONNECTIONS_OPENED_TOTAL._value.get()
+
+        for _ in range(3):
+            assert client.send_email_notification("email@example.com", "template-id") == {'id': 'notification-id'}
+
+        assert NOTIFY_REQUESTS_TOTAL._value.get() - requests_made == 3
+        assert NOTIFY_CONNECTIONS_OPENED_TOTAL._value.get() - connections_opened == 1
@@ -0,0 +1,201 @@
+import sqlite3
+from threading import Thread
+
+import mock
+import pytest
+
+from dmutils.email import EmailError
+from dmutils.email.exceptions import EmailInvalidError
+
+from app import email_outbox
+from app.outbox import SQLiteOutboxStore
+from .helpers import BaseApplicationTest
+
+
+class TestEmailOutbox(BaseApplicationTest):
+
+    def setup_method(self, method):
+        super().setup_method(method)
+        self.send_email_patch = mock.patch('app.notify.DMNotifyClient.send_email', autospec=True)
+        self.send_email = self.send_email_patch.start()
+
+    def teardown_method(self, method):
+        email_outbox.shutdown()
+        self.send_email_patch.stop()
+        super().teardown_method(method)
+
+    def _enable_outbox(self, **config):
+        self.app.config.update(DM_EMAIL_OUTBOX_ENABLED=True, DM_EMAIL_OUTBOX_RETRY_BACKOFF=0, **config)
+        email_outbox.init_app(self.app)
+
+    def test_sends_synchronously_when_disabled(self):
+        self.send_email.side_effect = EmailError("Notify API is down")
+
+        with self.app.test_request_context(), pytest.raises(EmailError):
+            email_outbox.send_email("email@example.com", template_name_or_id="reset_password", reference="ref")
+
+        assert self.send_email.call_args_list == [
+            mock.call(mock.ANY, "email@example.com", template_name_or_id="reset_password", reference="ref"),
+        ]
+
+    def test_emails_that_cant_be_queued_raise_email_error(self):
+        self._enable_outbox()
+
+        with mock.patch.object(email_outbox._store, 'add', side_effect=sqlite3.OperationalError("database is locked")):
+            with self.app.test_request_context(), pytest.raises(EmailError, match="database is locked"):
+                email_outbox.send_email("email@example.com", template_name_or_id="reset_password")
+
+    def test_queued_emails_are_sent_by_the_time_the_outbox_has_drained(self):
+        self._enable_outbox()
+        self.send_email.side_effect = EmailError("Notify API is down")
+
+        with self.app.test_request_context():
+            email_outbox.send_email("email@example.com", template_name_or_id="reset_password", reference="ref")
+        self.send_email.side_effect = None
+        email_outbox.shutdown()
+
+        assert mock.call(
+            mock.ANY, "email@example.com", template_name_or_id="reset_password", reference="ref",
+        ) in self.send_email.call_args_list
+
+    def test_failed_sends_are_retried(self):
+        self._enable_outbox()
+        self.send_email.side_effect = [EmailError("Notify API is down"), EmailError("Notify API is down"), None]
+
+        with self.app.test_request_context():
+            email_outbox.send_email("email@example.com", template_name_or_id="reset_password")
+        email_outbox.shutdown()
+
+        assert self.send_email.call_count == 3
+
+    @mock.patch('app.outbox.current_app')
+    def test_gives_up_after_max_attempts(self, current_app):
+        self._enable_outbox(DM_EMAIL_OUTBOX_MAX_ATTEMPTS=2)
+        self.send_email.side_effect = EmailError("Notify API is down")
+
+        with self.app.test_request_context():
+            email_outbox.send_email("email@example.com", template_name_or_id="reset_password", reference="ref")
+        email_outbox.shutdown()
+
+        assert self.send_email.call_count == 2
+        assert current_app.logger.error.call_args_list == [mock.call(
+            "{code}: Email with reference {reference} failed to send after {attempts} attempt(s). Error: {error}",
+            extra={
+                'code': 'email-outbox.notify-error',
+                'reference': 'ref',
+                'email_hash': mock.ANY,
+                'attempts': 2,
+                'error': 'Notify API is down',
+            },
+        )]
+
+    def test_invalid_email_addresses_are_not_retried(self):
+        self._enable_outbox()
+        self.send_email.side_effect = EmailInvalidError("email_address Not a valid email address")
+
+        with self.app.test_request_context():
+            email_outbox.send_email("not-an-email", template_name_or_id="reset_password")
+        email_outbox.shutdown()
+
+        assert self.send_email.call_count == 1
+
+    def test_store_errors_do_not_stop_delivery(self):
+        self._enable_outbox(DM_EMAIL_OUTBOX_POLL_INTERVAL=0.01)
+        claim = email_outbox._store.claim
+        failures = [sqlite3.OperationalError("database is locked")]
+
+        def flaky_claim(limit):
+            if failures:
+                raise failures.pop()
+            return claim(limit)
+
+        with mock.patch.object(email_outbox._store, 'claim', side_effect=flaky_claim):
+            with self.app.test_request_context():
+                email_outbox.send_email("email@example.com", template_name_or_id="reset_password")
+            email_outbox.shutdown()
+
+        assert self.send_email.call_count == 1
+
+    def test_a_worker_that_has_died_is_replaced(self):
+        self._enable_outbox()
+        with self.app.test_request_context():
+            email_outbox.send_email("first@example.com", template_name_or_id="reset_password")
+            dead_worker = Thread(target=lambda: None)
+            dead_worker.start()
+            dead_worker.join()
+            email_outbox._worker = dead_worker
+
+            email_outbox.send_email("second@example.com", template_name_or_id="reset_password")
+        email_outbox.shutdown()
+
+        assert mock.call(
+            mock.ANY, "second@example.com", template_name_or_id="reset_password",
+        ) in self.send_email.call_args_list
+
+
+class TestSQLiteOutboxStore(BaseApplicationTest):
+
+    def setup_method(self, method):
+        super().setup_method(method)
+        self.send_email_patch = mock.patch('app.notify.DMNotifyClient.send_email', autospec=True)
+        self.send_email = self.send_email_patch.start()
+
+    def teardown_method(self, method):
+        email_outbox.shutdown()
+        self.send_email_patch.stop()
+        super().teardown_method(method)
+
+    def test_emails_left_by_a_previous_worker_are_sent(self, tmpdir):
+        path = str(tmpdir.join('outbox.sqlite3'))
+        SQLiteOutboxStore(path, claim_timeout=300).add("old@example.com", {'template_name_or_id': "reset_password"})
+
+        self.app.config.update(DM_EMAIL_OUTBOX_ENABLED=True, DM_EMAIL_OUTBOX_PATH=path)
+        email_outbox.init_app(self.app)
+        with self.app.test_request_context():
+            email_outbox.send_email("new@example.com", template_name_or_id="reset_password")
+        email_outbox.shutdown()
+
+        assert sorted(self.send_email.call_args_list) == [
+            mock.call(mock.ANY, "new@example.com", template_name_or_id="reset_password"),
+            mock.call(mock.ANY, "old@example.com", template_name_or_id="reset_password"),
+        ]
+        assert SQLiteOutboxStore(path, claim_timeout=300).depth() == 0
+
+    @mock.patch('app.outbox.time')
+    def test_claims_lapse_if_the_worker_holding_them_dies(self, time, tmpdir):
+        time.return_value = 1000
+        store = SQLiteOutboxStore(str(tmpdir.join('outbox.sqlite3')), claim_timeout=300)
+        store.add("email@example.com", {'reference': "ref"})
+
+        assert [email.kwargs for email in store.claim(10)] == [{'reference': "ref"}]
+        time.return_value = 1300
+        assert store.claim(10) == []
+        time.return_value = 1301
+        assert [email.kwargs for email in store.claim(10)] == [{'reference': "ref"}]
+
+    @mock.patch('app.outbox.time')
+    def test_retries_are_rescheduled(self, time, tmpdir):
+        time.return_value = 1000
+        store = SQLiteOutboxStore(str(tmpdir.join('outbox.sqlite3')), claim_timeout=300)
+        store.add("email@example.com", {})
+        store.finish([], [(store.claim(10)[0], 1010)])
+
+        assert store.claim(10) == []
+        assert store.next_due_at() == 1010
+        time.return_value = 1010
+        assert [email.attempts for email in store.claim(10)] == [1]
+
+    def test_retries_are_sent_before_shutdown_finishes(self, tmpdir):
+        path = str(tmpdir.join('outbox.sqlite3'))
+        self.app.config.update(
+            DM_EMAIL_OUTBOX_ENABLED=True, DM_EMAIL_OUTBOX_PATH=path, DM_EMAIL_OUTBOX_RETRY_BACKOFF=0.05,
+        )
+        email_outbox.init_app(self.app)
+        self.send_email.side_effect = [EmailError("Notify API is down"), None]
+
+        with self.app.test_request_context():
+            email_outbox.send_email("email@example.com", template_name_or_id="reset_password")
+        email_outbox.shutdown()
+
+        assert self.send_email.call_count == 2
+        assert SQLiteOutboxStore(path, claim_timeout=300).depth() == 0
@@ -0,0 +1,75 @@
+import re
+
+import mock
+from flask_wtf.csrf import generate_csrf
+
+from app import rendered_page_cache
+from app.page_cache import CSRF_TOKEN_PLACEHOLDER
+from .helpers import BaseApplicationTest
+
+
+def _render_form_page(template_name, **context):
+    return '<form><input name="csrf_token" value="{}"></form>'.format(generate_csrf())
+
+
+class TestRenderedPageCache(BaseApplicationTest):
+
+    def setup_method(self, method):
+        super().setup_method(method)
+        self.app.config['DM_PAGE_CACHE_SIZE'] = 10
+        self.app.config['WTF_CSRF_ENABLED'] = True
+        rendered_page_cache.init_app(self.app)
+
+        self.render_template_patch = mock.patch('app.page_cache.render_template', side_effect=_render_form_page)
+        self.render_template = self.render_template_patch.start()
+
+    def teardown_method(self, method):
+        self.render_template_patch.stop()
+        rendered_page_cache.init_app(self.app)
+        super().teardown_method(method)
+
+    def _csrf_token(self, response):
+        return re.search(r'value="([^"]*)"', response.get_data(as_text=True)).group(1)
+
+    def test_page_is_rendered_once_with_each_visitor_getting_their_own_csrf_token(self):
+        first = self.client.get('/user/reset-password')
+        second = self.app.test_client().get('/user/reset-password')
+
+        assert first.status_code == second.status_code == 200
+        assert self.render_template.call_count == 1
+        assert CSRF_TOKEN_PLACEHOLDER not in second.get_data(as_text=True)
+        assert self._csrf_token(first) != self._csrf_token(second)
+
+    def test_query_args_that_dont_affect_the_page_are_ignored(self):
+        self.client.get('/user/cookie-settings')
+        self.client.get('/user/cookie-settings?foo=bar')
+        self.client.get('/user/cookie-settings?foo=baz')
+
+        assert self.render_template.call_count == 1
+
+    @mock.patch('app.main.views.auth.data_api_client')
+    def test_login_page_is_cached_per_next_url(self, data_api_client):
+        data_api_client.find_frameworks.return_value = {'frameworks': []}
+
+        self.client.get('/user/login?next=/buyers')
+        self.client.get('/user/login?next=/buyers&foo=bar')
+        self.client.get('/user/login?next=/suppliers')
+
+        assert [call[1]['next'] for call in self.render_template.call_args_list] == ['/buyers', '/suppliers']
+
+    def test_pages_with_flashed_messages_are_not_cached(self):
+        self.client.get('/user/reset-password')
+        with self.client.session_transaction() as session:
+            session['_flashes'] = [('message', 'Hello')]
+        self.client.get('/user/reset-password')
+
+        assert self.render_template.call_count == 2
+
+    def test_nothing_is_cached_when_size_is_zero(self):
+        self.app.config['DM_PAGE_CACHE_SIZE'] = 0
+        rendered_page_cache.init_app(self.app)
+
+        self.client.get('/user/cookie-settings')
+        self.client.get('/user/cookie-settings')
+
+        assert self.render_template.call_count == 2
@@ -0,0 +1,324 @@
+import flask
+import jinja2
+import jinja2.ext
+import mock
+import pytest
+
+from app.caching import ExpiringLRUCache
+from app.templating import (
+    FragmentCacheExtension,
+    ProfiledTemplate,
+    IndexedFileSystemLoader,
+    TemplateTransformCache,
+    VersionedFileSystemBytecodeCache,
+    init_compiled_templates,
+    init_template_bytecode_cache,
+    init_template_profiling,
+    stream_template,
+)
+from .helpers import BaseApplicationTest
+
+
+class TestVersionedFileSystemBytecodeCache(object):
+
+    def _environment(self, cache, templates):
+        return jinja2.Environment(loader=jinja2.DictLoader(templates), bytecode_cache=cache)
+
+    def test_compiled_templates_are_reused_by_a_new_environment(self, tmpdir):
+        cache = VersionedFileSystemBytecodeCache(str(tmpdir))
+        assert self._environment(cache, {'page.html': 'Hello {{ name }}'}).get_template('page.html').render(
+            name='world'
+        ) == 'Hello world'
+
+        environment = self._environment(cache, {'page.html': 'Hello {{ name }}'})
+        with mock.patch.object(environment, 'compile', side_effect=AssertionError("recompiled")):
+            assert environment.get_template('page.html').render(name='again') == 'Hello again'
+
+    def test_cache_keys_depend_on_toolchain_version(self):
+        cache = VersionedFileSystemBytecodeCache('/nonexistent')
+        key = cache.get_cache_key('page.html', '/templates/page.html')
+
+        with mock.patch('app.templating.TEMPLATE_TOOLCHAIN_VERSION', 'jinja2-0|govuk-frontend-jinja-0'):
+            assert cache.get_cache_key('page.html', '/templates/page.html') != key
+
+    @mock.patch('app.templating.os.replace', side_effect=PermissionError())
+    def test_templates_still_render_if_the_cache_cannot_be_written(self, replace, tmpdir):
+        cache = VersionedFileSystemBytecodeCache(str(tmpdir))
+
+        assert self._environment(cache, {'page.html': 'Hello'}).get_template('page.html').render() == 'Hello'
+        assert replace.called
+        assert tmpdir.listdir() == []
+
+
+class TestIndexedFileSystemLoader(object):
+
+    def _loader(self, tmpdir):
+        tmpdir.join('first', 'page.html').write('first page', ensure=True)
+        tmpdir.join('second', 'page.html').write('second page', ensure=True)
+        tmpdir.join('second', 'macros', 'button.html').write('button', ensure=True)
+        return IndexedFileSystemLoader([str(tmpdir.join('first')), str(tmpdir.join('second'))])
+
+    def test_templates_are_found_in_the_first_directory_they_are_in(self, tmpdir):
+        environment = jinja2.Environment(loader=self._loader(tmpdir))
+
+        assert environment.get_template('page.html').render() == 'first page'
+        assert environment.get_template('macros/button.html').render() == 'button'
+
+    def test_templates_are_found_without_probing_each_directory(self, tmpdir):
+        loader = self._loader(tmpdir)
+        loader.list_templates()
+
+        with mock.patch('app.templating.os.walk', side_effect=AssertionError("walked")):
+            with mock.patch('jinja2.loaders.open_if_exists', side_effect=AssertionError("probed")):
+                assert jinja2.Environment(loader=loader).get_template('macros/button.html').render() == 'button'
+
+    def test_missing_templates_are_not_found(self, tmpdir):
+        environment = jinja2.Environment(loader=self._loader(tmpdir))
+
+        with pytest.raises(jinja2.TemplateNotFound):
+            environment.get_template('missing.html')
+        with pytest.raises(jinja2.TemplateNotFound):
+            environment.get_template('../second/page.html')
+
+    def test_templates_are_not_checked_for_changes_without_auto_reload(self, tmpdir):
+        environment = jinja2.Environment(loader=self._loader(tmpdir), auto_reload=False)
+        environment.get_template('page.html')
+
+        tmpdir.join('first', 'new.html').write('new')
+        with pytest.raises(jinja2.TemplateNotFound):
+            environment.get_template('new.html')
+        with mock.patch('app.templating.os.path.getmtime', side_effect=AssertionError("checked")):
+            assert environment.get_template('page.html').render() == 'first page'
+
+    def test_new_and_changed_templates_are_picked_up_with_auto_reload(self, tmpdir):
+        environment = jinja2.Environment(loader=self._loader(tmpdir), auto_reload=True)
+        environment.get_template('page.html')
+
+        tmpdir.join('first', 'new.html').write('new')
+        assert environment.get_template('new.html').render() == 'new'
+
+        page = tmpdir.join('first', 'page.html')
+        page.write('changed page')
+        page.setmtime(page.mtime() + 10)
+        assert environment.get_template('page.html').render() == 'changed page'
+
+    def test_list_templates(self, tmpdir):
+        assert self._loader(tmpdir).list_templates() == ['macros/button.html', 'page.html']
+
+
+class TestFragmentCacheExtension(object):
+
+    def _environment(self, templates):
+        environment = jinja2.Environment(loader=jinja2.DictLoader(templates), extensions=[FragmentCacheExtension])
+        environment.fragment_cache = ExpiringLRUCache(maxsize=10, ttl=60)
+        return environment
+
+    def test_fragments_are_rendered_once_per_key(self):
+        template = self._environment({
+            'page.html': "{% cache ('greeting', role) %}Hello {{ role }} {{ name }}{% endcache %}, {{ name }}",
+        }).get_template('page.html')
+
+        assert template.render(role='buyer', name='Alice') == 'Hello buyer Alice, Alice'
+        assert template.render(role='buyer', name='Bob') == 'Hello buyer Alice, Bob'
+        assert template.render(role='supplier', name='Bob') == 'Hello supplier Bob, Bob'
+
+    def test_fragments_with_the_same_key_in_different_templates_are_cached_separately(self):
+        environment = self._environment({
+            'one.html': "{% cache 'fragment' %}one{% endcache %}",
+            'two.html': "{% cache 'fragment' %}two{% endcache %}",
+        })
+
+        assert environment.get_template('one.html').render() == 'one'
+        assert environment.get_template('two.html').render() == 'two'
+
+    def test_fragments_expire_after_their_ttl(self):
+        environment = self._environment({'page.html': "{% cache 'fragment', 0 %}{{ name }}{% endcache %}"})
+
+        assert environment.get_template('page.html').render(name='Alice') == 'Alice'
+        assert environment.get_template('page.html').render(name='Bob') == 'Bob'
+
+    def test_blocks_in_fragments_can_be_overridden(self):
+        environment = self._environment({
+            'base.html': "[{% cache 'crumbs' %}{% block crumbs %}base{% endblock %}{% endcache %}]",
+            'child.html': "{% extends 'base.html' %}{% block crumbs %}child{% endblock %}",
+        })
+
+        assert environment.get_template('child.html').render() == '[child]'
+
+    def test_fragments_in_layouts_are_cached_separately_for_each_page(self):
+        environment = self._environment({
+            'base.html': "[{% cache 'crumbs' %}{% block crumbs %}{% endblock %}{% endcache %}]",
+            'error.html': "{% extends 'base.html' %}",
+            'login.html': "{% extends 'base.html' %}{% block crumbs %}Home > Log in{% endblock %}",
+        })
+
+        assert environment.get_template('error.html').render() == '[]'
+        assert environment.get_template('login.html').render() == '[Home > Log in]'
+
+
+class _NunjucksLikeExtension(jinja2.ext.Extension):
+    def preprocess(self, source, name, filename=None):
+        self.environment.transform_count += 1
+        return source.replace('[[', '{{').replace(']]', '}}')
+
+
+class TestTemplateTransformCache(object):
+
+    def _environment(self, directory=None):
+        environment = jinja2.Environment(extensions=[_NunjucksLikeExtension])
+        environment.transform_count = 0
+        TemplateTransformCache(environment, directory)
+        return environment
+
+    def test_source_is_only_transformed_once(self):
+        environment = self._environment()
+
+        assert environment.from_string('Hello [[ name ]]').render(name='world') == 'Hello world'
+        assert environment.from_string('Hello [[ name ]]').render(name='again') == 'Hello again'
+        assert environment.transform_count == 1
+
+        assert environment.from_string('Bye [[ name ]]').render(name='world') == 'Bye world'
+        assert environment.transform_count == 2
+
+    def test_transformed_source_is_shared_through_directory(self, tmpdir):
+        assert self._environment(str(tmpdir)).from_string('Hello [[ name ]]').render(name='world') == 'Hello world'
+
+        environment = self._environment(str(tmpdir))
+        assert environment.from_string('Hello [[ name ]]').render(name='world') == 'Hello world'
+        assert environment.transform_count == 0
+
+
+class TestInitTemplateFragmentCache(BaseApplicationTest):
+
+    def test_fragments_are_not_cached_in_tests(self):
+        template = self.app.jinja_env.from_string("{% cache 'fragment' %}{{ name }}{% endcache %}")
+
+        assert template.render(name='Alice') == 'Alice'
+        assert template.render(name='Bob') == 'Bob'
+
+
+class TestProfiledTemplate(object):
+
+    def _environment(self, template_class=ProfiledTemplate):
+        environment = jinja2.Environment(
+            autoescape=jinja2.select_autoescape(['html']),
+            loader=jinja2.DictLoader({
+                'macros.njk': "{% macro bold(text) %}<b>{{ text }}{{ caller() if caller }}</b>{% endmacro %}",
+                'base.html': "<p>{% block content %}{% endblock %}</p>",
+                'page.html': (
+                    "{% extends 'base.html' %}{% from 'macros.njk' import bold %}"
+                    "{% block content %}{{ bold(text) }}{% call bold(text) %}<i>{% endcall %}{% endblock %}"
+                ),
+            }),
+        )
+        environment.template_class = template_class
+        return environment
+
+    def test_output_is_unchanged(self):
+        assert self._environment().get_template('page.html').render(text='<a>') == (
+            self._environment(jinja2.Template).get_template('page.html').render(text='<a>')
+        )
+
+    def test_render_and_macro_times_are_recorded_for_the_request(self):
+        with flask.Flask(__name__).app_context():
+            self._environment().get_template('page.html').render(text='hello')
+            profile = flask.g.template_profile
+
+        assert sorted(profile) == [
+            ('macro', 'bold'), ('template', 'base.html'), ('template', 'macros.njk'), ('template', 'page.html'),
+        ]
+        assert profile[('macro', 'bold')][0] == 2
+        assert profile[('template', 'page.html')][1] >= profile[('template', 'base.html')][1]
+
+
+class TestInitTemplateProfiling(BaseApplicationTest):
+
+    def test_templates_are_not_profiled_by_default(self):
+        assert self.app.jinja_env.template_class is jinja2.Template
+
+    def test_profile_is_logged_at_the_end_of_each_request(self):
+        self.app.config['DM_TEMPLATE_PROFILING'] = True
+        self.app.config['DM_TEMPLATE_PROFILING_REPORT'] = True
+        init_template_profiling(self.app)
+
+        with mock.patch.object(self.app.logger, 'info') as info:
+            with self.app.test_request_context('/'):
+                self.app.jinja_env.from_string('Hello').render()
+                self.app.do_teardown_request()
+
+        assert info.call_args[1]['extra']['template_profile'].startswith('template <string>: 1 calls, ')
+
+
+class TestStreamTemplate(BaseApplicationTest):
+
+    def _stream(self, source, **context):
+        with self.app.test_request_context('/'):
+            return list(stream_template(self.app.jinja_env.from_string(source), **context))
+
+    def test_head_is_sent_before_the_body(self):
+        chunks = self._stream(
+            '<html><head><title>{{ title }}</title></head><body>{% for i in range(3) %}{{ i }}{% endfor %}</body>',
+            title='Hello',
+        )
+
+        assert chunks == ['<html><head><title>Hello</title></head><body>', '012</body>']
+
+    @mock.patch('app.templating.STREAM_CHUNK_SIZE', 4)
+    def test_body_is_sent_in_chunks(self):
+        chunks = self._stream('<head></head>{% for i in range(10) %}{{ i }}{% endfor %}')
+
+        assert chunks[0] == '<head></head>'
+        assert ''.join(chunks[1:]) == '0123456789'
+        assert all(len(chunk) >= 4 for chunk in chunks[1:-1])
+
+    def test_rendering_is_signalled(self):
+        with mock.patch('app.templating.template_rendered') as template_rendered:
+            self._stream('<head></head>{{ name }}', name='world')
+
+        assert template_rendered.send.call_args[1]['context']['name'] == 'world'
+
+    def test_rendering_is_signalled_before_the_response_starts(self):
+        with mock.patch('app.templating.before_render_template') as before_render_template:
+            with self.app.test_request_context('/'):
+                stream_template(self.app.jinja_env.from_string('Hello'))
+
+        assert before_render_template.send.called
+
+
+class TestInitTemplateBytecodeCache(BaseApplicationTest):
+
+    def test_no_cache_by_default(self):
+        assert self.app.jinja_env.bytecode_cache is None
+
+    def test_cache_is_installed_when_configured(self, tmpdir):
+        self.app.config['DM_TEMPLATE_BYTECODE_CACHE_DIR'] = str(tmpdir.join('bytecode'))
+        init_template_bytecode_cache(self.app)
+
+        assert isinstance(self.app.jinja_env.bytecode_cache, VersionedFileSystemBytecodeCache)
+        assert tmpdir.join('bytecode').isdir()
+
+
+class TestInitCompiledTemplates(BaseApplicationTest):
+
+    def test_compiled_templates_are_loaded_without_their_source(self, tmpdir):
+        self.app.jinja_env.compile_templates(
+            str(tmpdir), zip=None, filter_func=lambda name: name == 'auth/login.html'
+        )
+        self.app.config['DM_COMPILED_TEMPLATES_DIR'] = str(tmpdir)
+        init_compiled_templates(self.app)
+
+        with mock.patch.object(IndexedFileSystemLoader, 'get_source', side_effect=AssertionError("read source")):
+            assert self.app.jinja_env.get_template('auth/login.html').name == 'auth/login.html'
+
+    def test_templates_that_were_not_compiled_are_loaded_from_source(self, tmpdir):
+        self.app.config['DM_COMPILED_TEMPLATES_DIR'] = str(tmpdir)
+        init_compiled_templates(self.app)
+
+        assert self.app.jinja_env.get_template('auth/login.html').name == 'auth/login.html'
+
+    def test_missing_directory_is_ignored(self, tmpdir):
+        loader = self.app.jinja_env.loader
+        self.app.config['DM_COMPILED_TEMPLATES_DIR'] = str(tmpdir.join('missing'))
+        init_compiled_templates(self.app)
+
+        assert self.app.jinja_env.loader is loader
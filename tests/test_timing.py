@@ -0,0 +1,62 @@
+import mock
+import pytest
+
+from app.timing import ResponseTimeEqualiser
+from .helpers import BaseApplicationTest
+
+
+class TestResponseTimeEqualiser(BaseApplicationTest):
+
+    def setup_method(self, method):
+        super().setup_method(method)
+        self.app.config.update(
+            DM_RESET_PASSWORD_MIN_RESPONSE_TIME=0.5,
+            DM_RESET_PASSWORD_MAX_RESPONSE_TIME=2,
+            DM_RESET_PASSWORD_RESPONSE_TIME_PERCENTILE=50,
+            DM_RESET_PASSWORD_RESPONSE_TIME_SAMPLES=3,
+        )
+        self.timing = ResponseTimeEqualiser('test', 'DM_RESET_PASSWORD')
+        self.timing.init_app(self.app)
+
+    def test_target_is_the_minimum_until_there_are_samples(self):
+        assert self.timing.target() == 0.5
+
+    def test_target_is_a_percentile_of_recent_samples(self):
+        for duration in (0.6, 5, 0.8, 0.7):
+            self.timing.record(duration)
+
+        assert self.timing.target() == 0.8
+
+    def test_target_is_clamped(self):
+        self.timing.record(5)
+        assert self.timing.target() == 2
+
+        self.timing.record(0.1)
+        self.timing.record(0.1)
+        assert self.timing.target() == 0.5
+
+    @mock.patch('app.timing.sleep')
+    @mock.patch('app.timing.monotonic')
+    def test_equalise_pads_to_the_target_and_records_slow_branches(self, monotonic, sleep):
+        monotonic.side_effect = [100, 101.2, 101.2]
+        with self.timing.equalise() as record:
+            record()
+
+        assert sleep.call_args_list == []
+        assert self.timing.target() == pytest.approx(1.2)
+
+        monotonic.side_effect = [200, 200.2]
+        with pytest.raises(ValueError), self.timing.equalise():
+            raise ValueError()
+
+        assert sleep.call_args_list == [mock.call(pytest.approx(1))]
+
+    @mock.patch('app.timing.sleep')
+    def test_padding_is_off_if_the_maximum_is_zero(self, sleep):
+        self.app.config['DM_RESET_PASSWORD_MAX_RESPONSE_TIME'] = 0
+        self.timing.init_app(self.app)
+
+        with self.timing.equalise():
+            pass
+
+        assert sleep.call_args_list == []
@@ -0,0 +1,88 @@
+import mock
+from freezegun import freeze_time
+
+import pytest
+from cryptography.fernet import InvalidToken
+
+from dmutils.email import generate_token
+from dmutils.email.tokens import decode_token
+
+from app import invitation_token_cache, token_service
+from app.caching import CACHE_LOOKUPS_TOTAL
+from .helpers import BaseApplicationTest
+
+
+class TestTokenService(BaseApplicationTest):
+
+    def test_generated_tokens_can_be_decoded_by_dmutils(self):
+        token = token_service.generate_reset_password_token(123)
+
+        data, _ = decode_token(token, self.app.config['SHARED_EMAIL_KEY'], self.app.config['RESET_PASSWORD_TOKEN_NS'])
+        assert data == {'user': 123}
+
+    def test_generated_tokens_are_only_valid_for_their_namespace(self):
+        token = token_service.generate_reset_password_token(123)
+
+        with pytest.raises(InvalidToken):
+            decode_token(token, self.app.config['SHARED_EMAIL_KEY'], self.app.config['INVITE_EMAIL_TOKEN_NS'])
+
+
+class TestInvitationTokenCache(BaseApplicationTest):
+
+    def setup_method(self, method):
+        super().setup_method(method)
+        self.decode_patch = mock.patch.object(
+            token_service, 'decode_invitation_token', wraps=token_service.decode_invitation_token
+        )
+        self.decode_invitation_token = self.decode_patch.start()
+
+    def teardown_method(self, method):
+        self.decode_patch.stop()
+        super().teardown_method(method)
+
+    def _generate_token(self):
+        return generate_token(
+            {'role': 'buyer', 'email_address': 'test@email.com'},
+            self.app.config['SHARED_EMAIL_KEY'],
+            self.app.config['INVITE_EMAIL_TOKEN_NS'],
+        )
+
+    @staticmethod
+    def _lookups(result):
+        return CACHE_LOOKUPS_TOTAL.labels('invitation_tokens', result)._value.get()
+
+    def test_valid_token_is_only_decoded_once(self):
+        token = self._generate_token()
+        hits, misses = self._lookups('hit'), self._lookups('miss')
+
+        with self.app.app_context():
+            first = invitation_token_cache.decode(token)
+            second = invitation_token_cache.decode(token)
+
+        assert first == second == {'role': 'buyer', 'email_address': 'test@email.com'}
+        assert first is not second
+        assert self.decode_invitation_token.call_args_list == [mock.call(token)]
+        assert self._lookups('hit') - hits == 1
+        assert self._lookups('miss') - misses == 1
+
+    def test_invalid_token_is_not_cached(self):
+        with self.app.app_context():
+            assert invitation_token_cache.decode('1234') == {'error': 'token_invalid'}
+            assert invitation_token_cache.decode('1234') == {'error': 'token_invalid'}
+
+        assert self.decode_invitation_token.call_count == 2
+
+    @mock.patch('app.caching.monotonic')
+    def test_cached_token_expires_with_the_token(self, monotonic):
+        with freeze_time('2016-09-28 16:00:00'):
+            token = self._generate_token()
+
+        monotonic.return_value = 1000
+        with freeze_time('2016-10-05 15:59:00'), self.app.app_context():
+            assert 'error' not in invitation_token_cache.decode(token)
+
+        monotonic.return_value = 1120
+        with freeze_time('2016-10-05 16:01:00'), self.app.app_context():
+            assert invitation_token_cache.decode(token)['error'] == 'token_expired'
+
+        assert self.decode_invitation_token.call_count == 2